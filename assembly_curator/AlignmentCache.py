@@ -0,0 +1,96 @@
+import os
+import time
+import logging
+import hashlib
+import tempfile
+
+import numpy as np
+
+# Temporary files older than this were left by a put() that crashed: a running one finishes much sooner
+ORPHAN_MAX_AGE = 3600  # seconds
+
+
+class AlignmentCache:
+    """
+    Content-addressed store for pairwise alignments, shared by all samples in a samples directory.
+
+    Entries are keyed by the hash of the reference and query sequences plus the aligner parameters, so renaming
+    a sample or resetting it does not invalidate them. evict() removes the least recently used entries once the
+    cache grows beyond max_size bytes: it scans the whole cache, hence it runs once per run, not on every put().
+    """
+    cache_dir: str
+    max_size: int
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_sequence(sequence: bytes) -> str:
+        return hashlib.sha256(sequence).hexdigest()
+
+    @staticmethod
+    def key(ref_hash: str, qry_hash: str, params: [str], backend: str) -> str:
+        return hashlib.sha256('\0'.join([backend, ' '.join(params), ref_hash, qry_hash]).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.npy')
+
+    def get(self, key: str) -> np.ndarray | None:
+        path = self._path(key)
+        try:
+            hits = np.load(path)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return hits
+
+    def put(self, key: str, hits: np.ndarray):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first: several workers may store the same pair at the same time
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, hits)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def entries(self, suffixes: (str,) = ('.npy',)) -> [os.DirEntry]:
+        entries = []
+        for subdir in os.scandir(self.cache_dir):
+            if subdir.is_dir():
+                entries.extend(e for e in os.scandir(subdir.path) if e.name.endswith(suffixes))
+        return entries
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False  # removed by another worker
+        return True
+
+    def evict(self):
+        """Several workers may evict at the same time: entries that disappear meanwhile are skipped"""
+        entries, orphans = [], 0
+        for e in self.entries(suffixes=('.npy', '.tmp')):
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                continue
+            if not e.name.endswith('.tmp'):
+                entries.append((stat.st_mtime, stat.st_size, e.path))
+            elif stat.st_mtime < time.time() - ORPHAN_MAX_AGE and self._remove(e.path):
+                orphans += 1
+        if orphans:
+            logging.info(f'Removed {orphans} temporary files of interrupted writes from {self.cache_dir}')
+        total_size = sum(size for _, size, _ in entries)
+        if total_size <= self.max_size:
+            return
+        for mtime, size, path in sorted(entries):
+            self._remove(path)  # freed either way, also if another worker removed it first
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+        logging.info(f'Evicted alignments from {self.cache_dir}, size is now {total_size} bytes')
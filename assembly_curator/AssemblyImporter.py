@@ -1,13 +1,18 @@
+import gzip
+import shutil
 import logging
 import os.path
 from glob import glob
+from tempfile import TemporaryDirectory
 from abc import ABC, abstractmethod
 from typing import TYPE_CHECKING
 
-from .utils import AssemblyFailedException, run_command
+from .utils import AssemblyFailedException, run_command, compressed_path, is_gzipped, open_text
 from .Assembly import Assembly
 from .Contig import Contig
 from .ContigGroup import ContigGroup
+from .FastaReader import FastaReader
+from .composition import format_issues
 
 
 class AssemblyImporter(ABC):
@@ -34,59 +39,82 @@ class AssemblyImporter(ABC):
         return self.__class__.__name__
 
     def load_fasta(self, fasta: str) -> {str: Contig}:
-        matches = glob(fasta)
+        matches = [m for m in glob(fasta) if not m.endswith(('.fai', '.gzi'))] or glob(f'{fasta}.gz')
         if len(matches) != 1:
             raise AssemblyFailedException(
                 f'{self.name}: Expected exactly one match for {fasta=}, but found {len(matches)}')
         fasta = matches[0]
 
-        with open(fasta) as f:
-            data = f.read().strip()
-        if not data:
-            raise AssemblyFailedException(f'{self.name}: FASTA file {fasta} is empty')
-
-        contigs = {}
-        for entry in data.split('>'):
-            entry = entry.strip()
-            if entry == '': continue  # start or end of FASTA file
-            contig_header, sequence = entry.split('\n', 1)
-            sequence = sequence.replace('\n', '')
-            assert set(sequence) == {'A', 'T', 'C', 'G'}
-
-            contig = Contig(
-                importer=self,
-                fasta_file=fasta,
-                original_contig_header=contig_header,
-                assembler=self.assembler,
-                sequence=sequence,
-            )
-            contigs[contig.original_id] = contig
+        with FastaReader(fasta) as reader:
+            if len(reader) == 0:
+                raise AssemblyFailedException(f'{self.name}: FASTA file {fasta} is empty')
+
+            contigs = {}
+            for name in reader.index:
+                contig_header, sequence = reader.header(name), reader.sequence(name)
+                if not sequence:
+                    raise AssemblyFailedException(f'{self.name}: Empty sequence {name} in {fasta}')
+
+                contig = Contig(
+                    importer=self,
+                    fasta_file=fasta,
+                    original_contig_header=contig_header,
+                    assembler=self.assembler,
+                    sequence=sequence,
+                    fasta_record=name,
+                )
+                if 'invalid' in contig.sequence_issues:
+                    raise AssemblyFailedException(
+                        f'{self.name}: Invalid characters in {contig.id}: {format_issues(contig.sequence_issues)}')
+                contigs[contig.original_id] = contig
 
         return contigs
 
-    def create_groups(self, connections) -> [[str]]:
-        groups = [[segment] for segment in connections.keys()]
+    def create_groups(self, connections: {str: [str]}) -> [[str]]:
+        """
+        The connected components of the graph, in a disjoint-set forest with path compression.
+
+        Groups and the segments in them are in the order they would have if, for each connection, the group of the
+        segment were extended by the group of the connected segment.
+        """
+        segments = list(connections)
+        index = {segment: i for i, segment in enumerate(segments)}
+        parent = list(range(len(segments)))
+        size = [1] * len(segments)
+        # Of each root: the position of its group in the result, and its segments as a linked list
+        position = list(range(len(segments)))
+        head, tail, following = list(range(len(segments))), list(range(len(segments))), [-1] * len(segments)
+
+        def find(i: int) -> int:
+            root = i
+            while parent[root] != root:
+                root = parent[root]
+            while parent[i] != root:
+                parent[i], i = root, parent[i]
+            return root
+
         for segment, connected_segments in connections.items():
             for connected_segment in connected_segments:
-                # find and merge the groups that contain the connected segments
-                group1 = None
-                group2 = None
-                for group in groups:
-                    if segment in group:
-                        group1 = group
-                    if connected_segment in group:
-                        group2 = group
-                    if group1 and group2:
-                        break
-                if group1 is None:
-                    raise AssertionError(f'{self.name}: {segment=} not in any group')
-                if group2 is None:
+                if connected_segment not in index:
                     raise AssertionError(f'{self.name}: {connected_segment=} not in any group')
-                if group1 == group2:
+                root1, root2 = find(index[segment]), find(index[connected_segment])
+                if root1 == root2:
                     continue
-                group1.extend(group2)
-                groups.remove(group2)
-
+                following[tail[root1]] = head[root2]
+                merged = head[root1], tail[root2], position[root1]
+                if size[root1] < size[root2]:
+                    root1, root2 = root2, root1  # union by size keeps the trees shallow
+                parent[root2] = root1
+                size[root1] += size[root2]
+                head[root1], tail[root1], position[root1] = merged
+
+        groups = []
+        for root in sorted((i for i in range(len(segments)) if parent[i] == i), key=lambda i: position[i]):
+            group, i = [], head[root]
+            while i != -1:
+                group.append(segments[i])
+                i = following[i]
+            groups.append(group)
         return groups
 
     def create_assembly(self, groups: [[str]], contigs: {str: Contig}) -> Assembly:
@@ -133,7 +161,8 @@ class AssemblyImporter(ABC):
                     if segment1 == segment2:
                         circular.add(segment1)
 
-        with open(gfa) as file:
+        gfa = compressed_path(gfa)
+        with open_text(gfa) as file:
             for line in file:
                 parts = line.strip().split('\t')
                 record_type = parts[0]
@@ -157,7 +186,8 @@ class AssemblyImporter(ABC):
     def gfa_to_svg(self, gfa: str, overwrite: bool = True, params: [str] = ['--labels']):
         gfa_dirname = os.path.dirname(gfa)
         gfa_basename = os.path.basename(gfa)
-        svg_basename = f'{gfa_basename}.svg'
+        svg_basename = f'{gfa_basename}.svg'  # also if the GFA is compressed
+        gfa = compressed_path(gfa)
         svg_path = os.path.join(gfa_dirname, svg_basename)
 
         if os.path.isfile(svg_path):
@@ -168,9 +198,18 @@ class AssemblyImporter(ABC):
                 logging.info(f'Skipping {svg_basename} as it already exists')
                 return
 
-        cmd = self._gfa_to_svg_cmd(gfa_basename, svg_basename, params)
-        logging.info(f'Running: {cmd}')
-        return_code = run_command(cmd, cwd=gfa_dirname)
+        if is_gzipped(gfa):
+            # gfaviz only reads plain text
+            with TemporaryDirectory() as tmpdir:
+                with gzip.open(gfa, 'rb') as f_in, open(os.path.join(tmpdir, gfa_basename), 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                cmd = self._gfa_to_svg_cmd(gfa_basename, os.path.abspath(svg_path), params)
+                logging.info(f'Running: {cmd}')
+                return_code = run_command(cmd, cwd=tmpdir)
+        else:
+            cmd = self._gfa_to_svg_cmd(gfa_basename, svg_basename, params)
+            logging.info(f'Running: {cmd}')
+            return_code = run_command(cmd, cwd=gfa_dirname)
         assert return_code == 0 and os.path.isfile(svg_path), f'Failed to create {svg_basename}'
 
     def _gfa_to_svg_cmd(self, gfa_basename: str, svg_basename: str, params: str = ['--labels']):
@@ -1,8 +1,66 @@
 import json
 import os
-from collections import Counter
+import threading
+from collections import OrderedDict
+
+import numpy as np
 
 from .utils import human_bp, invariant_atgc_count
+from .FastaReader import FastaReader
+from .PackedSequence import PackedSequence
+from .composition import GC_PROFILE_WINDOW, base_composition, count_atgc, sequence_issues
+
+# Bases of decoded contig sequences kept in memory per process, least recently used first out. 0: decode or read
+# on every access
+CONTIG_CACHE_BP = int(os.environ.get('CONTIG_CACHE_BP', '50000000'))
+# FASTA files kept open per process to read lazy contigs: gzip-compressed ones are decompressed once per reader
+CONTIG_READERS = int(os.environ.get('CONTIG_READERS', '4'))
+
+# (fasta, mtime, record name) or ('packed', id) -> (the packed sequence, to keep its id valid, or None; sequence)
+_sequence_cache: {tuple: (PackedSequence | None, bytes)} = OrderedDict()
+_readers: {(str, int): FastaReader} = OrderedDict()  # (fasta, mtime) -> reader
+# The web server reads contigs in several threads
+_sequence_cache_lock = threading.Lock()
+_readers_lock = threading.Lock()  # also held while reading: a reader must not be closed or seeked meanwhile
+
+
+def cached_sequence(key: tuple, decode, packed: PackedSequence = None) -> bytes:
+    """A decoded sequence through the per-process cache: decode() is only called on a miss"""
+    with _sequence_cache_lock:
+        if key in _sequence_cache:
+            _sequence_cache.move_to_end(key)
+            return _sequence_cache[key][1]
+    sequence = decode()
+    if len(sequence) <= CONTIG_CACHE_BP:
+        with _sequence_cache_lock:
+            _sequence_cache[key] = (packed, sequence)
+            cached_bp = sum(len(s) for _, s in _sequence_cache.values())
+            while cached_bp > CONTIG_CACHE_BP:
+                cached_bp -= len(_sequence_cache.popitem(last=False)[1][1])
+    return sequence
+
+
+def get_reader(fasta: str, mtime: int) -> FastaReader:
+    """Call with _readers_lock held"""
+    key = (fasta, mtime)
+    if key in _readers:
+        _readers.move_to_end(key)
+    else:
+        _readers[key] = FastaReader(fasta)
+        while len(_readers) > max(CONTIG_READERS, 1):
+            _readers.popitem(last=False)[1].close()
+    return _readers[key]
+
+
+def read_sequence(fasta: str, record: str) -> bytes:
+    """A record of a FASTA file, through the per-process caches of readers and sequences"""
+    mtime = os.stat(fasta).st_mtime_ns
+
+    def read() -> bytes:
+        with _readers_lock:
+            return get_reader(fasta, mtime).sequence(record)
+
+    return cached_sequence((fasta, mtime, record), read)
 
 
 class Contig:
@@ -10,13 +68,16 @@ class Contig:
     fasta_file: str
     original_id: str
     original_contig_header: str
-    sequence: str
+    _sequence: PackedSequence = None
+    _fasta_record: (str, str) = None  # lazy contigs: (absolute fasta path, record name), read on access
     assembler: str = None
     topology: str = None
     location: str = None
     coverage: int = None
     additional_info: list[str] = []
     _len = None
+    gc_profile: (int, np.ndarray, np.ndarray) = None  # window, GC and GC skew per window in percent
+    sequence_issues: {str: int} = {}  # number of lowercase, N, IUPAC and invalid characters
 
     def __init__(
             self,
@@ -24,24 +85,64 @@ class Contig:
             fasta_file: str,
             original_contig_header: str,
             assembler: str,
-            sequence: str = None,
+            sequence: str | bytes = None,
+            fasta_record: str = None,
     ):
+        """
+        With fasta_record, the name of the sequence in fasta_file, only the counts of the sequence are kept: it is
+        read from the file again when needed.
+        """
         self.importer = importer
         self.fasta_file = fasta_file
         self.original_contig_header = original_contig_header
         self.original_id = original_contig_header.split(' ', 1)[0].rsplit('|', 1)[-1]
-        self.sequence = sequence
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii')
         if sequence is not None:
-            atgc_count = {'A': 0, 'T': 0, 'G': 0, 'C': 0} | Counter(sequence)
-            assert set(atgc_count) == {'A', 'T', 'C', 'G'}, \
-                f'Error in {self}: Invalid characters in sequence: atgc_count={self.atgc_count}'
-            self.atgc_count = invariant_atgc_count(atgc_count)
+            histogram, gc, skew = base_composition(sequence)
+            self.atgc_count = invariant_atgc_count(count_atgc(histogram))
+            self.sequence_issues = sequence_issues(histogram)
+            self.gc_profile = (GC_PROFILE_WINDOW, gc, skew)
+        if fasta_record is None:
+            self.sequence = sequence
+        else:
+            self._len = len(sequence)
+            self._fasta_record = (os.path.abspath(fasta_file), fasta_record)
         self.assembler = assembler
 
     @property
     def id(self):
         return f'{self.assembler}@{self.original_id}'
 
+    @property
+    def sequence(self) -> str | None:
+        """A new str on every access: encode_sequence() returns the cached bytes"""
+        sequence = self.encode_sequence()
+        return None if sequence is None else sequence.decode('ascii')
+
+    @sequence.setter
+    def sequence(self, sequence: str | bytes | None):
+        self._sequence = None if sequence is None else PackedSequence(sequence)
+        self._fasta_record = None
+
+    def encode_sequence(self) -> bytes | None:
+        """The sequence as bytes, decoded or read from the FASTA file once and then cached per process"""
+        if self._fasta_record is not None:
+            sequence = read_sequence(*self._fasta_record)
+            assert len(sequence) == self._len, \
+                f'Error in {self}: {self._fasta_record[0]} changed since it was imported'
+            return sequence
+        if self._sequence is None:
+            return None
+        return cached_sequence(('packed', id(self._sequence)), lambda: bytes(self._sequence), self._sequence)
+
+    def __setstate__(self, state: dict):
+        # assemblies.pkl of earlier versions hold the sequence as str
+        sequence = state.pop('sequence', None)
+        self.__dict__.update(state)
+        if sequence is not None:
+            self.sequence = sequence
+
     def header(self, contig_name: str, plasmid_name: str = None) -> str:
         self.sanity_check()
 
@@ -77,7 +178,7 @@ class Contig:
     def __len__(self) -> int:
         if self._len:
             return self._len
-        return len(self.sequence)
+        return len(self._sequence)
 
     def len_human(self) -> str:
         return human_bp(len(self))
@@ -158,6 +259,11 @@ class Contig:
             'additional_info': self.additional_info,
             'test-header': self.header('test_scf0', plasmid_name='test-plasmid')
         }
+        if self.sequence_issues:
+            res['sequence_issues'] = self.sequence_issues
+        if self.gc_profile is not None:
+            window, gc, skew = self.gc_profile
+            res['gc_profile'] = {'window': window, 'gc': gc.tolist(), 'skew': skew.tolist()}
         if sequence: res['sequence'] = self.sequence
         if contig_group: res['contig_group'] = contig_group
         res.update(additional_data)
@@ -183,5 +289,10 @@ class Contig:
         contig.coverage = data['coverage']
         contig.additional_info = data['additional_info']
         contig.sequence = data.get('sequence', None)
+        contig.sequence_issues = data.get('sequence_issues', {})
+        if 'gc_profile' in data:
+            gc_profile = data['gc_profile']
+            contig.gc_profile = (gc_profile['window'], np.array(gc_profile['gc'], dtype=np.uint8),
+                                 np.array(gc_profile['skew'], dtype=np.int8))
         contig.contig_group = data.get('contig_group', None)
         return contig
@@ -1,5 +1,6 @@
 import json
 import os.path
+from functools import cached_property
 
 from .utils import human_bp
 from .Contig import Contig
@@ -54,8 +55,9 @@ class ContigGroup:
     def sort(self):
         self.contigs = sorted(self.contigs, key=lambda contig: len(contig), reverse=True)
 
-    @property
+    @cached_property
     def atgc_count(self):
+        # The contigs of a group do not change once it is created
         return {key: sum(c.atgc_count[key] for c in self.contigs) for key in 'ATGC'}
 
     @property
@@ -80,7 +82,7 @@ class ContigGroup:
 
     def encode_sequences(self) -> [bytes]:
         # Format used by skani
-        return [contig.sequence.encode('ascii') for contig in self.contigs]
+        return [contig.encode_sequence() for contig in self.contigs]
 
     def to_json(self, sequence: bool = False):
         info = {}
@@ -0,0 +1,231 @@
+import os
+import zlib
+import gzip
+import mmap
+import bisect
+import logging
+import tempfile
+
+import numpy as np
+
+from assembly_curator.utils import is_gzipped
+
+
+class FastaReader:
+    """
+    Memory-mapped FASTA file with a samtools-style index (<fasta>.fai), for all parsers of the package.
+
+    The file is never read into a Python string: each sequence is copied once from the mapping, without line breaks.
+    The index is written next to the FASTA file and reused as long as it is newer. Records whose lines do not all
+    have the same length get LINEBASES = LINEWIDTH = 0 and are read by stripping the line breaks instead.
+
+    gzip-compressed files are decompressed into memory. For bgzip-compressed files, the block offsets are saved in a
+    samtools-style <fasta>.gzi: once both indices exist, only the blocks of the requested contigs are decompressed.
+    """
+    fasta: str
+    index: {str: (int, int, int, int)}  # name -> (length, offset, line bases, line width)
+    _blocks: [(int, int)] = None  # bgzip: (compressed, uncompressed) offset of each block
+
+    def __init__(self, fasta: str):
+        self.fasta = fasta
+        self.index = self.read_index(fasta)
+        if not is_gzipped(fasta):
+            with open(fasta, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        elif self.index is not None and (blocks := self._read_gzi()) is not None:
+            self._blocks = blocks
+            self._file = open(fasta, 'rb')
+        else:
+            self._mm = self._decompress()
+        if self.index is None:
+            self.index = self._build_index()
+            self._write(self.fai, lambda f: f.writelines(
+                f'{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n'
+                for name, (length, offset, line_bases, line_width) in self.index.items()))
+        offsets = [offset for _, offset, _, _ in self.index.values()]
+        self._next_offset = dict(zip(self.index, offsets[1:]))
+
+    @property
+    def fai(self) -> str:
+        return f'{self.fasta}.fai'
+
+    @property
+    def gzi(self) -> str:
+        return f'{self.fasta}.gzi'
+
+    @staticmethod
+    def is_current(path: str, fasta: str) -> bool:
+        return os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(fasta)
+
+    @classmethod
+    def read_index(cls, fasta: str) -> dict | None:
+        """The index in <fasta>.fai, if it is current"""
+        fai = f'{fasta}.fai'
+        if not cls.is_current(fai, fasta):
+            return None
+        try:
+            with open(fai) as f:
+                index = {}
+                for line in f:
+                    name, length, offset, line_bases, line_width = line.rstrip('\n').split('\t')[:5]
+                    index[name] = (int(length), int(offset), int(line_bases), int(line_width))
+                return index
+        except ValueError:
+            return None
+
+    def _read_gzi(self) -> list | None:
+        if not self.is_current(self.gzi, self.fasta):
+            return None
+        with open(self.gzi, 'rb') as f:
+            data = f.read()
+        n_blocks = int.from_bytes(data[:8], 'little')
+        if len(data) != 8 + n_blocks * 16:
+            return None
+        offsets = np.frombuffer(data, dtype='<u8', offset=8).reshape(n_blocks, 2)
+        return [(0, 0)] + [(int(c), int(u)) for c, u in offsets]
+
+    def _decompress(self) -> bytes:
+        with open(self.fasta, 'rb') as f:
+            raw = f.read()
+        if raw[12:14] != b'BC':
+            return gzip.decompress(raw)  # plain gzip: no random access
+        blocks, chunks, position, uncompressed = [], [], 0, 0
+        while position < len(raw):
+            block_size = int.from_bytes(raw[position + 16:position + 18], 'little') + 1
+            chunk = zlib.decompress(raw[position + 18:position + block_size - 8], wbits=-15)
+            if chunk:  # not the empty block at the end
+                blocks.append((position, uncompressed))
+            chunks.append(chunk)
+            position += block_size
+            uncompressed += len(chunk)
+        self._write(self.gzi, lambda f: f.write(
+            len(blocks[1:]).to_bytes(8, 'little') + np.array(blocks[1:], dtype='<u8').tobytes()), mode='wb')
+        return b''.join(chunks)
+
+    def _inflate(self, start: int, end: int | None) -> bytes:
+        """Decompress the uncompressed range [start, end) from the blocks that contain it"""
+        i = bisect.bisect_right([u for _, u in self._blocks], start) - 1
+        compressed, uncompressed = self._blocks[i]
+        self._file.seek(compressed)
+        chunks, position = [], uncompressed
+        while end is None or position < end:
+            header = self._file.read(18)
+            if len(header) < 18:
+                break
+            block = self._file.read(int.from_bytes(header[16:18], 'little') + 1 - 18)
+            chunks.append(zlib.decompress(block[:-8], wbits=-15))
+            position += len(chunks[-1])
+        data = b''.join(chunks)
+        return data[start - uncompressed:None if end is None else end - uncompressed]
+
+    def _region(self, start: int, end: int | None) -> (bytes, int):
+        """A buffer that contains the range [start, end), and the position of start in it"""
+        if self._blocks is None:
+            return self._mm, start
+        return self._inflate(start, end), 0
+
+    def _build_index(self) -> {str: (int, int, int, int)}:
+        data = np.frombuffer(self._mm, dtype=np.uint8)
+        newlines = np.flatnonzero(data == ord('\n'))
+        starts = np.concatenate([[0], newlines + 1])
+        ends = np.concatenate([newlines, [len(data)]])
+        starts, ends = starts[starts < len(data)], ends[starts < len(data)]
+        widths = ends - starts - (data[np.maximum(ends - 1, 0)] == ord('\r'))  # bases per line
+        headers = np.flatnonzero(data[starts] == ord('>'))
+        assert not widths[:headers[0] if len(headers) else len(starts)].any(), \
+            f'{self.fasta} does not start with a FASTA header'
+
+        index = {}
+        for h, next_h in zip(headers, np.append(headers[1:], len(starts))):
+            header = bytes(self._mm[starts[h] + 1:ends[h]]).decode().rstrip('\r')
+            name = header.split(maxsplit=1)[0] if header.strip() else ''
+            assert name not in index, f'Duplicate contig {name} in {self.fasta}'
+            lines = widths[h + 1:next_h]
+            lines = lines[:np.flatnonzero(lines)[-1] + 1] if lines.any() else lines[:0]  # trailing blank lines
+            offset = int(ends[h] + 1)
+            if len(lines) == 1:
+                index[name] = (int(lines[0]), offset, int(lines[0]), int(ends[h + 1] - starts[h + 1] + 1))
+            elif len(lines) and (lines[:-1] == lines[0]).all() and lines[-1] <= lines[0]:
+                index[name] = (int(lines.sum()), offset, int(lines[0]), int(starts[h + 2] - starts[h + 1]))
+            else:
+                index[name] = (int(lines.sum()), offset, 0, 0)
+        return index
+
+    @staticmethod
+    def _write(path: str, write, mode: str = 'w'):
+        # Write to a temporary file first: several workers may index the same file at the same time
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        except OSError as e:
+            logging.debug(f'Not saving {path}: {e}')
+            return
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def lengths(cls, fasta: str) -> {str: int}:
+        """The length of each sequence, from the index alone if it is current"""
+        index = cls.read_index(fasta)
+        if index is None:
+            with cls(fasta) as reader:
+                index = reader.index
+        return {name: length for name, (length, _, _, _) in index.items()}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __iter__(self):
+        """Yield (header, sequence) in file order"""
+        for name in self.index:
+            yield self.header(name), self.sequence(name)
+
+    def header(self, name: str) -> str:
+        """The full header line, without '>'"""
+        offset = self.index[name][1]
+        window = 1024
+        while True:
+            start = max(offset - window, 0)
+            data, position = self._region(start, offset)
+            end = position + offset - start  # the line break after the header is at end - 1
+            line_start = data.rfind(b'\n', position, end - 1) + 1
+            if line_start or start == 0:
+                break
+            window *= 8
+        return bytes(data[max(line_start, position) + 1:end]).decode().rstrip('\r\n')
+
+    def sequence(self, name: str) -> bytes:
+        length, offset, line_bases, line_width = self.index[name]
+        if length == 0:
+            return b''
+        if line_bases == 0:
+            # irregular line lengths: the sequence ends at the next record
+            data, position = self._region(offset, self._next_offset.get(name))
+            end = data.find(b'>', position)
+            return b''.join(data[position:end if end != -1 else len(data)].split())
+        n_lines = -(-length // line_bases)
+        last = length - (n_lines - 1) * line_bases  # the last line may be shorter and lack its line break
+        span = (n_lines - 1) * line_width + last
+        data, position = self._region(offset, offset + span)
+        data = np.frombuffer(data, dtype=np.uint8, count=span, offset=position)
+        if n_lines == 1:
+            return data.tobytes()
+        lines = np.lib.stride_tricks.as_strided(data, shape=(n_lines - 1, line_bases), strides=(line_width, 1))
+        return lines.tobytes() + data[-last:].tobytes()
+
+    def close(self):
+        if self._blocks is not None:
+            self._file.close()
+        elif isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,71 @@
+import numpy as np
+
+BASES = b'ACGT'
+INVALID_CODE = 255
+CODES = np.full(256, INVALID_CODE, dtype=np.uint8)
+CODES[np.frombuffer(BASES, dtype=np.uint8)] = np.arange(4)
+# The four 2-bit codes in each possible packed byte, and their bases
+UNPACK = (np.arange(256, dtype=np.uint8)[:, np.newaxis] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3
+DECODE = np.frombuffer(BASES, dtype=np.uint8)[UNPACK]
+
+
+def runs(mask: np.ndarray) -> np.ndarray:
+    """(start, end) of each run of True"""
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8)))
+    return edges.reshape(-1, 2)
+
+
+class PackedSequence:
+    """
+    A DNA sequence packed into 2 bits per base: a quarter of the memory of a str, in workers and in assemblies.pkl.
+
+    Lowercase (soft-masked) regions are packed like the rest, their case is kept as runs in a separate mask.
+    Characters other than A, C, G and T (runs of N, IUPAC codes) are stored as runs in a side table and as A in the
+    packed data. bytes() and str() decode the sequence on demand, without caching it.
+    """
+    __slots__ = ('length', 'packed', 'lowercase', 'exceptions')
+    length: int
+    packed: bytes
+    lowercase: np.ndarray  # (start, end) of each run of lowercase characters
+    exceptions: [(int, bytes)]  # (start, uppercase characters) of each run of other characters
+
+    def __init__(self, sequence: str | bytes):
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii')
+        data = np.frombuffer(sequence, dtype=np.uint8)
+        lower = (data >= ord('a')) & (data <= ord('z'))
+        self.lowercase = runs(lower)
+        if len(self.lowercase):
+            data = data ^ (lower.view(np.uint8) << 5)  # to uppercase
+        codes = CODES[data]
+        invalid = codes == INVALID_CODE
+        self.exceptions = []
+        if invalid.any():
+            self.exceptions = [(int(start), data[start:end].tobytes()) for start, end in runs(invalid)]
+            codes[invalid] = 0
+        self.length = len(codes)
+        quads = np.zeros(-(-self.length // 4) * 4, dtype=np.uint8)
+        quads[:self.length] = codes
+        quads = quads.reshape(-1, 4)
+        self.packed = (quads[:, 0] << 6 | quads[:, 1] << 4 | quads[:, 2] << 2 | quads[:, 3]).tobytes()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __bytes__(self) -> bytes:
+        data = DECODE[np.frombuffer(self.packed, dtype=np.uint8)].ravel()[:self.length]
+        for start, run in self.exceptions:
+            data[start:start + len(run)] = np.frombuffer(run, dtype=np.uint8)
+        if len(self.lowercase):
+            edges = np.zeros(self.length + 1, dtype=np.int8)
+            edges[self.lowercase[:, 0]] += 1
+            edges[self.lowercase[:, 1]] -= 1
+            data |= np.cumsum(edges[:-1], dtype=np.int8).view(np.uint8) << 5
+        return data.tobytes()
+
+    def __str__(self) -> str:
+        return bytes(self).decode('ascii')
+
+    def __repr__(self) -> str:
+        return (f'<PackedSequence: {self.length}bp, {len(self.lowercase)} lowercase runs, '
+                f'{len(self.exceptions)} runs of other characters>')
@@ -0,0 +1,116 @@
+import os
+import sys
+import mmap
+import shutil
+import logging
+import tempfile
+from multiprocessing import shared_memory, resource_tracker
+
+from assembly_curator.AlignmentCache import AlignmentCache
+
+SHM_DIR = '/dev/shm'
+# Space left free in SHM_DIR: containers get only 64MB by default, and writing beyond it kills the process (SIGBUS)
+SHM_RESERVE_MB = float(os.environ.get('SHM_RESERVE_MB', '16'))
+
+
+def shm_fits(size: int) -> bool:
+    if not os.path.isdir(SHM_DIR):
+        return True  # no tmpfs to check, e.g. macOS
+    return size + SHM_RESERVE_MB * 1024 ** 2 <= shutil.disk_usage(SHM_DIR).free
+
+
+def attach_shm(name: str) -> shared_memory.SharedMemory:
+    """Attach to a block created by another process, without taking ownership of it"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Before 3.13, attaching registers the block with the resource tracker, which then reports it as leaked, or
+    # unlinks it, when this process exits
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SequenceStore:
+    """
+    Sequences of a sample in one block of shared memory, to hand them to dotplot workers without writing files.
+
+    The store pickles to its name and offsets only: workers attach to the same block instead of receiving a copy.
+    If the block does not fit into /dev/shm, the sequences are written to a file in spill_dir instead, which the
+    workers map. The process that created the store must call unlink() when all workers are done, and workers
+    call close() when they have read their sequences.
+    """
+    offsets: {str: (int, int)}
+    hashes: {str: str}
+    shm: shared_memory.SharedMemory = None
+    path: str = None  # file that backs the store if it did not fit into shared memory
+    _mm: mmap.mmap = None
+    attached: bool = False  # unpickled in a worker
+
+    def __init__(self, sequences: {str: bytes}, spill_dir: str = None):
+        size = max(sum(len(s) for s in sequences.values()), 1)
+        self.offsets, self.hashes = {}, {}
+        start = 0
+        for key, sequence in sequences.items():
+            self.offsets[key] = (start, start + len(sequence))
+            self.hashes[key] = AlignmentCache.hash_sequence(sequence)
+            start += len(sequence)
+
+        if shm_fits(size):
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            for key, sequence in sequences.items():
+                start, end = self.offsets[key]
+                self.shm.buf[start:end] = sequence
+        else:
+            if spill_dir is not None:
+                os.makedirs(spill_dir, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(dir=spill_dir, suffix='.seq')
+            logging.info(f'Not enough space in {SHM_DIR} for {size} bytes of sequences, using {self.path}')
+            with os.fdopen(fd, 'wb') as f:
+                f.writelines(sequences.values())
+                f.truncate(size)
+            self._map()
+
+    def _map(self):
+        with open(self.path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        return {'name': None if self.shm is None else self.shm.name, 'path': self.path,
+                'offsets': self.offsets, 'hashes': self.hashes}
+
+    def __setstate__(self, state):
+        self.offsets = state['offsets']
+        self.hashes = state['hashes']
+        self.path = state['path']
+        self.attached = True
+        if self.path is None:
+            self.shm = attach_shm(state['name'])
+        else:
+            self._map()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.offsets
+
+    def get(self, key: str) -> str:
+        start, end = self.offsets[key]
+        buf = self._mm if self.shm is None else self.shm.buf
+        return bytes(buf[start:end]).decode('ascii')
+
+    def hash(self, key: str) -> str:
+        return self.hashes[key]
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+        else:
+            self._mm.close()
+
+    def unlink(self):
+        self.close()
+        if self.shm is not None:
+            self.shm.unlink()
+        else:
+            os.remove(self.path)
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import pyskani
+
+from assembly_curator.utils import get_cache_dir
+
+# A database is rebuilt from scratch once more than this fraction of its genomes is no longer requested
+SKETCH_STALE_FRACTION = float(os.environ.get('SKETCH_STALE_FRACTION', '0.25'))
+
+
+class SketchStore:
+    """
+    Persistent pyskani sketches under a samples directory, reused by later runs of the same scope.
+
+    A scope is one sample (its contig groups) or the cohort (the representative assembly of each sample). Sketches
+    are not shared between scopes: a query is compared to every sketch in a database, so a database shared by all
+    samples would make the ANI of each sample scale with the cohort, while samples hardly ever share a contig group.
+    Within a scope, genomes are indexed by the hash of their contigs, so reruns and resets only sketch what changed.
+    A sketch keeps the name of the genome it was first made for: skani's estimates depend slightly on names. pyskani
+    cannot remove sketches from a database, hence a scope is rebuilt once too many of its genomes are stale.
+    Databases of other pyskani versions or sketch parameters are kept apart and never loaded.
+    """
+    store_dir: str
+    params: str
+
+    def __init__(self, store_dir: str):
+        db = pyskani.Database()
+        self.params = f'pyskani{pyskani.__version__}-c{db.compression}-m{db.marker_compression}'
+        self.store_dir = store_dir
+        os.makedirs(self.params_dir, exist_ok=True)
+
+    @property
+    def params_dir(self) -> str:
+        return os.path.join(self.store_dir, self.params)
+
+    @staticmethod
+    def key(contigs: [bytes]) -> str:
+        h = hashlib.sha256()
+        for contig in contigs:
+            h.update(len(contig).to_bytes(8, 'little'))
+            h.update(contig)
+        return h.hexdigest()
+
+    def _db_path(self, scope: str) -> str:
+        return os.path.join(self.params_dir, scope)
+
+    @staticmethod
+    def read_index(db_path: str) -> dict:
+        try:
+            with open(os.path.join(db_path, 'index.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'genomes': {}}
+
+    def database(
+            self, scope: str, genomes: {str: [bytes]}, sketched: {str: str} = None, progress=None
+    ) -> (pyskani.Database, {str: str}):
+        """
+        Load the database of a scope and sketch the genomes (name -> contigs) that are missing.
+
+        sketched lists genomes that should already be in the database (name -> key), whose contigs need not be
+        read. Those that are not, e.g. because the database was rebuilt, are left out of the returned names.
+        progress(step, done, total) is called before each genome is sketched.
+        Returns the database and the names of the sketches in it (name -> sketch name).
+        """
+        sketched = sketched or {}
+        keys = {name: self.key(contigs) for name, contigs in genomes.items()}
+        db_path = self._db_path(scope)
+        index = self.read_index(db_path)
+        stale = index['genomes'].keys() - set(keys.values()) - set(sketched.values())
+
+        db = None
+        if index['genomes'] and len(stale) <= SKETCH_STALE_FRACTION * (len(genomes) + len(sketched)):
+            try:
+                db = pyskani.Database.load(db_path)
+            except (OSError, ValueError) as e:
+                logging.warning(f'Rebuilding sketch database {db_path}: {e}')
+        if db is None:
+            db, index = pyskani.Database(), {'genomes': {}}
+
+        new = 0
+        sketch_names = {genome['sketch'] for genome in index['genomes'].values()}
+        for i, (name, contigs) in enumerate(genomes.items()):
+            key = keys[name]
+            if key not in index['genomes']:
+                if progress:
+                    progress('Sketching', i, len(genomes))
+                # The name may belong to a stale sketch, e.g. after the sample was reassembled
+                sketch_name = name if name not in sketch_names else f'{name}#{key[:12]}'
+                db.sketch(sketch_name, *contigs)
+                sketch_names.add(sketch_name)
+                index['genomes'][key] = {'sketch': sketch_name, 'length': sum(len(c) for c in contigs)}
+                new += 1
+            index['genomes'][key]['last_used'] = time.time()
+        for key in sketched.values():
+            if key in index['genomes']:
+                index['genomes'][key]['last_used'] = time.time()
+        keys |= {name: key for name, key in sketched.items() if key in index['genomes']}
+        logging.info(f'Sketch store {scope}: {len(keys) - new} sketches loaded, {new} sketched')
+
+        if new or not os.path.isdir(db_path):
+            self._save(db, db_path, index)
+        else:
+            self._write_index(db_path, index)
+        return db, {name: index['genomes'][key]['sketch'] for name, key in keys.items()}
+
+    def _save(self, db: pyskani.Database, db_path: str, index: dict):
+        # Save next to the old database and swap: a concurrent reader never sees a partial database
+        tmp_path = tempfile.mkdtemp(dir=self.params_dir, prefix='.tmp-')
+        db.save(os.path.join(tmp_path, 'db'))
+        self._write_index(os.path.join(tmp_path, 'db'), index)
+        old_path = f'{tmp_path}-old'
+        if os.path.isdir(db_path):
+            os.replace(db_path, old_path)
+        os.replace(os.path.join(tmp_path, 'db'), db_path)
+        shutil.rmtree(tmp_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @staticmethod
+    def _write_index(db_path: str, index: dict):
+        fd, tmp_path = tempfile.mkstemp(dir=db_path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(db_path, 'index.json'))
+
+    def scopes(self) -> [dict]:
+        """All databases in the store, including those of other pyskani versions"""
+        scopes = []
+        for params_dir in os.scandir(self.store_dir):
+            if not params_dir.is_dir():
+                continue
+            for db_dir in os.scandir(params_dir.path):
+                if not db_dir.is_dir() or db_dir.name.startswith('.tmp-'):
+                    continue
+                genomes = self.read_index(db_dir.path)['genomes']
+                scopes.append({
+                    'params': params_dir.name,
+                    'scope': db_dir.name,
+                    'path': db_dir.path,
+                    'genomes': len(genomes),
+                    'size': sum(e.stat().st_size for e in os.scandir(db_dir.path) if e.is_file()),
+                    'last_used': max((g['last_used'] for g in genomes.values()), default=db_dir.stat().st_mtime),
+                })
+        return scopes
+
+
+def inspect(samples_dir: str):
+    """List the sketch databases of a samples directory"""
+    store = SketchStore(get_cache_dir(samples_dir, 'sketches'))
+    scopes = sorted(store.scopes(), key=lambda s: (s['params'], s['scope']))
+    for s in scopes:
+        last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(s['last_used']))
+        current = '' if s['params'] == store.params else ' (outdated)'
+        print(f"{s['params']}/{s['scope']}\t{s['genomes']} genomes\t{s['size'] / 1e6:.1f}MB\t"
+              f"last used {last_used}{current}")
+    print(f'{len(scopes)} databases, {sum(s["size"] for s in scopes) / 1e6:.1f}MB')
+
+
+def prune(samples_dir: str, days: float = 30, all: bool = False):
+    """Remove sketch databases not used for the given number of days, of other pyskani versions, or all of them"""
+    store = SketchStore(get_cache_dir(samples_dir, 'sketches'))
+    cutoff = time.time() - days * 24 * 3600
+    freed = 0
+    for s in store.scopes():
+        if all or s['params'] != store.params or s['last_used'] < cutoff:
+            shutil.rmtree(s['path'])
+            freed += s['size']
+            print(f"Removed {s['params']}/{s['scope']}")
+    for params_dir in os.scandir(store.store_dir):
+        if params_dir.is_dir() and not os.listdir(params_dir.path):
+            os.rmdir(params_dir.path)
+    print(f'Freed {freed / 1e6:.1f}MB')
+
+
+def main():
+    from fire import Fire
+
+    Fire({'inspect': inspect, 'prune': prune})
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
+import os
+import json
+import base64
 import logging
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import TemporaryDirectory
 import numpy as np
 import pandas as pd
 import scipy.cluster.hierarchy as sch
 import seaborn as sns
 import matplotlib
-import matplotlib.pyplot as plt
+import matplotlib.colors
 import plotly.graph_objects as go
 import plotly.figure_factory as ff
 import pyskani
@@ -14,19 +17,32 @@ import pyskani
 from assembly_curator import ContigGroup
 from assembly_curator.utils import AssemblyFailedException, MinorAssemblyException
 from assembly_curator.Assembly import Assembly
+from assembly_curator.SketchStore import SketchStore
 
 matplotlib.use('SVG')
 
+# pyskani releases the GIL while querying, so threads are enough to use all cores
+ANI_THREADS = int(os.environ.get('ANI_THREADS', os.cpu_count()))
+# Defaults of the clustering, which can be changed per sample with recluster_sample
+ANI_CUTOFF = float(os.environ.get('ANI_CUTOFF', '.9'))  # lower end of the color scale and of the length labels
+CLUSTER_THRESHOLD = float(os.environ.get('CLUSTER_THRESHOLD', '.95'))  # distance at which the linkage is cut
 
-def ani_clustermap(assemblies: [Assembly], fname: str, cutoff: float = .9) -> (pd.DataFrame, str):
+
+def ani_clustermap(
+        assemblies: [Assembly], fname: str, cutoff: float = ANI_CUTOFF, threshold: float = CLUSTER_THRESHOLD,
+        sketch_store: SketchStore = None, scope: str = None, similarity_matrix: pd.DataFrame = None
+) -> (pd.DataFrame, str):
+    """Pass a similarity_matrix to cluster again without calculating ANI"""
     assert len(assemblies) > 0, "No assemblies to cluster!"
-    similarity_matrix = calculate_similarity_matrix(assemblies)
+    if similarity_matrix is None:
+        similarity_matrix = calculate_similarity_matrix(assemblies, sketch_store=sketch_store, scope=scope)
 
     length_matrix = calculate_length_matrix(similarity_matrix, assemblies, label_cutoff=cutoff)
 
-    cluster_to_color, cg_to_cluster = plot_clustermap(
+    cluster_to_color, cg_to_cluster = write_clustermap(
         similarity_matrix,
-        annot=length_matrix, annot_kws={"fontsize": 6}, fmt='',
+        threshold=threshold,
+        annot=length_matrix,
         vmin=cutoff, vmax=1,
         fname=fname
     )
@@ -45,100 +61,126 @@ def calculate_length_matrix(
         assemblies: [Assembly],
         label_cutoff: float = .9
 ) -> pd.DataFrame:
+    """
+    Annotations for the clustermap: for each pair of similar contig groups (i, j), the ratio len(i) / len(j).
+    The diagonal shows the topology or the number of contigs.
+    """
     contig_groups = {cg.id: cg for assembly in assemblies for cg in assembly.contig_groups}
-    contig_group_to_len = {id: len(cg) for id, cg in contig_groups.items()}
-
-    # Create a dataframe with same col/rows as similarity_matrix
-    # for each contig group (i, j), store the len(i) / len(j), i.e. the ratio of the lengths
-    length_matrix = pd.DataFrame(index=similarity_matrix.index, columns=similarity_matrix.columns)
-    for i, cg_id_i in enumerate(similarity_matrix.index):
-        for j, cg_id_j in enumerate(similarity_matrix.columns):
-            if cg_id_i == cg_id_j:
-                cg: ContigGroup = contig_groups[cg_id_i]
-                length_matrix.iloc[i, j] = cg.topology_or_n_contigs(short=True)
-                continue
-            if similarity_matrix.iloc[i, j] > label_cutoff:
-                frac = contig_group_to_len[cg_id_i] / contig_group_to_len[cg_id_j]
-                length_matrix.iloc[i, j] = f'{frac:.2g}'
-            else:
-                length_matrix.iloc[i, j] = ''
-
-    return length_matrix
-
-
-def calculate_similarity_matrix(assemblies: [Assembly]):
-    """Decision: create fasta for each contig or for each contig_group"""
-    # Create a temporary directory for the pyskani sketches
-    pyskani_db = pyskani.Database()
-
-    # Import all contig groups into the skani database
-    for assembly in assemblies:
-        for contig_group in assembly.contig_groups:
-            pyskani_db.sketch(contig_group.id, *contig_group.encode_sequences())
+    ids = similarity_matrix.index
+    lengths = np.array([len(contig_groups[cg_id]) for cg_id in ids], dtype=float)
 
-    contig_group_ids = [cg.id for assembly in assemblies for cg in assembly.contig_groups]
-    similarity_matrix = pd.DataFrame(index=contig_group_ids, columns=contig_group_ids, data=0.0)
+    labels = np.char.mod('%.2g', lengths[:, np.newaxis] / lengths[np.newaxis, :]).astype(object)
+    labels[similarity_matrix.to_numpy() <= label_cutoff] = ''
+    labels[np.diag_indices(len(ids))] = [contig_groups[cg_id].topology_or_n_contigs(short=True) for cg_id in ids]
 
-    for assembly in assemblies:
-        for contig_group in assembly.contig_groups:
-            hits = pyskani_db.query(contig_group.id, *contig_group.encode_sequences())
+    return pd.DataFrame(labels, index=ids, columns=similarity_matrix.columns)
+
+
+def calculate_similarity_matrix(
+        assemblies: [Assembly], n_threads: int = ANI_THREADS,
+        sketch_store: SketchStore = None, scope: str = None
+) -> pd.DataFrame:
+    """
+    Decision: create fasta for each contig or for each contig_group
+
+    With a sketch_store, the sketches of the scope (normally the sample) are reused from its previous runs, and only
+    new contig groups are sketched.
+    """
+    contig_groups = [cg for assembly in assemblies for cg in assembly.contig_groups]
+    contig_group_ids = [cg.id for cg in contig_groups]
+    sequences = [cg.encode_sequences() for cg in contig_groups]
+
+    # Import all contig groups into the skani database. Sketching modifies the database: not in parallel.
+    if sketch_store is None:
+        pyskani_db = pyskani.Database()
+        for cg_id, contigs in zip(contig_group_ids, sequences):
+            pyskani_db.sketch(cg_id, *contigs)
+        names = {cg_id: cg_id for cg_id in contig_group_ids}
+    else:
+        pyskani_db, names = sketch_store.database(scope, dict(zip(contig_group_ids, sequences)))
+
+    # Identical contig groups share a sketch; sketches of stale contig groups are ignored
+    name_to_indices = {}
+    for i, cg_id in enumerate(contig_group_ids):
+        name_to_indices.setdefault(names[cg_id], []).append(i)
+
+    def query(i: int) -> [pyskani.Hit]:
+        return pyskani_db.query(contig_group_ids[i], *sequences[i])
+
+    similarity = np.zeros((len(contig_groups), len(contig_groups)))
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        for i, hits in enumerate(executor.map(query, range(len(contig_groups)))):
             for hit in hits:
-                similarity_matrix.at[contig_group.id, hit.reference_name] = hit.identity
+                similarity[i, name_to_indices.get(hit.reference_name, [])] = hit.identity
 
     # This similarity matrix is not always symmetric. We enforce this to get a nice diagonal after clustering.
-    similarity_matrix = (similarity_matrix + similarity_matrix.T) / 2
+    similarity = (similarity + similarity.T) / 2
+
+    return pd.DataFrame(similarity, index=contig_group_ids, columns=contig_group_ids)
 
-    return similarity_matrix
 
+def write_clustermap(
+        similarity_matrix: pd.DataFrame, fname: str, threshold: float = CLUSTER_THRESHOLD,
+        annot: pd.DataFrame = None, vmin: float = 0., vmax: float = 1.
+) -> (str, np.ndarray):
+    """
+    Cluster the similarity matrix and write what assemblies.js needs to draw the clustermap on a canvas.
 
-def plot_clustermap(similarity_matrix: pd.DataFrame, fname: str, **kwargs) -> (str, np.ndarray):
-    plt.rcParams['svg.fonttype'] = 'none'
+    The matrix is stored in dendrogram order, as the index of the color of each cell: vmin to vmax is mapped to 0 to
+    255. Most cells are below vmin, so only the others are stored, as base64 encoded arrays of their positions in
+    the flattened matrix (uint32) and of their colors (uint8). The linkage refers to leaves by their position in
+    that order. Only the non-empty annotations are stored.
+    """
     assert (similarity_matrix.index == similarity_matrix.columns).all(), \
         "Similarity matrix must be square:\nindex={similarity_matrix.index}\ncolumns={similarity_matrix.columns}"
 
     # Compute the linkage matrix manually so it can be returned
     linkage_matrix = sch.linkage(similarity_matrix, method='average')
 
-    cluster_to_color, cg_to_cluster = group_by_linkage(similarity_matrix, linkage_matrix)
-    row_col_colors = [cluster_to_color[cg_to_cluster[cg]] for cg in similarity_matrix.index]
-
-    # Generate the clustermap
-    clustermap_fig = sns.clustermap(
-        similarity_matrix,
-        figsize=(max(10, len(similarity_matrix) / 2), max(10, len(similarity_matrix) / 2)),
-        cmap='mako_r',
-        linewidths=5,
-        row_cluster=True,
-        col_cluster=True,
-        row_linkage=linkage_matrix,
-        col_linkage=linkage_matrix,
-        row_colors=row_col_colors,
-        col_colors=row_col_colors,
-        **kwargs
-    )
+    cluster_to_color, cg_to_cluster = group_by_linkage(similarity_matrix, linkage_matrix, threshold)
 
-    svg_buffer = StringIO()
-    clustermap_fig.savefig(svg_buffer, format='svg')
-    plt.close()
-    svg_content = svg_buffer.getvalue()
-    svg_buffer.close()
+    order = sch.leaves_list(linkage_matrix)
+    labels = similarity_matrix.index[order]
+    position = np.empty(len(order), dtype=int)
+    position[order] = np.arange(len(order))
+    linkage = linkage_matrix.copy()
+    for column in [0, 1]:
+        is_leaf = linkage[:, column] < len(order)
+        linkage[is_leaf, column] = position[linkage[is_leaf, column].astype(int)]
 
-    # reorder cluster_to_color to match order in clustermap_fig.data2d.columns
-    cluster_to_color = {cg_to_cluster[cg]: cluster_to_color[cg_to_cluster[cg]] for cg in clustermap_fig.data2d.columns}
+    # reorder cluster_to_color to match the order of the clustermap
+    cluster_to_color = {cg_to_cluster[cg]: cluster_to_color[cg_to_cluster[cg]] for cg in labels}
 
-    # Convert to JSON, add to SVG
-    json_data = similarity_matrix.to_json()  # Reordering not necessary because json uses keys, not order
-    svg_content = svg_content.rsplit('</svg>', 1)
-    assert svg_content[1].strip() == '', f"Unexpected content after closing svg tag: {svg_content[1]}"
-    svg_content = f'{svg_content[0]}\n<script type="application/json" id="ani-matrix-data">{json_data}</script></svg>'
+    similarity = similarity_matrix.to_numpy()[np.ix_(order, order)]
+    similarity = np.rint(np.clip((similarity - vmin) / (vmax - vmin), 0, 1) * 255).astype(np.uint8).ravel()
+    cells = np.flatnonzero(similarity)
+    annotations = []
+    if annot is not None:
+        annot = annot.loc[labels, labels].to_numpy()
+        annotations = [[int(i), int(j), annot[i, j]] for i, j in zip(*np.nonzero(annot != ''))]
 
     with open(fname, 'w') as f:
-        f.write(svg_content)
+        json.dump({
+            'labels': labels.tolist(),
+            'clusters': [cg_to_cluster[cg] for cg in labels],
+            'cluster_colors': {cluster: matplotlib.colors.to_hex(color) for cluster, color in cluster_to_color.items()},
+            'linkage': [[int(a), int(b), round(float(d), 6), int(n)] for a, b, d, n in linkage],
+            'similarity': {
+                'cells': base64.b64encode(cells.astype('<u4').tobytes()).decode('ascii'),
+                'colors': base64.b64encode(similarity[cells].tobytes()).decode('ascii'),
+            },
+            'annotations': annotations,
+            'vmin': vmin,
+            'vmax': vmax,
+            'cmap': sns.color_palette('mako_r', 256).as_hex(),
+        }, f, separators=(',', ':'))
 
     return cluster_to_color, cg_to_cluster
 
 
-def group_by_linkage(similarity_matrix, linkage_matrix: np.ndarray, threshold: float = .95) -> {int: [str]}:
+def group_by_linkage(
+        similarity_matrix, linkage_matrix: np.ndarray, threshold: float = CLUSTER_THRESHOLD
+) -> {int: [str]}:
     """Form flat clusters based on threshold"""
     # create contig_group -> cluster mapping
     cluster_ids = sch.fcluster(linkage_matrix, t=threshold, criterion='distance')
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+# Bases per window of the GC and GC skew profiles of contigs
+GC_PROFILE_WINDOW = int(os.environ.get('GC_PROFILE_WINDOW', '5000'))
+
+# Class of each byte in a sequence: soft-masked (lowercase) bases, N and the other IUPAC codes are accepted
+VALID, LOWERCASE, N, IUPAC, INVALID = range(5)
+CLASS_NAMES = ['valid', 'lowercase', 'N', 'IUPAC', 'invalid']
+BYTE_CLASSES = np.full(256, INVALID, dtype=np.uint8)
+for chars, byte_class in [(b'ACGT', VALID), (b'acgt', LOWERCASE), (b'Nn', N), (b'RYSWKMBDHVryswkmbdhv', IUPAC)]:
+    BYTE_CLASSES[np.frombuffer(chars, dtype=np.uint8)] = byte_class
+# 1 for G, 2 for C, in either case
+GC_CODES = np.zeros(256, dtype=np.uint8)
+GC_CODES[np.frombuffer(b'Gg', dtype=np.uint8)] = 1
+GC_CODES[np.frombuffer(b'Cc', dtype=np.uint8)] = 2
+
+
+def base_composition(sequence: bytes, window: int = GC_PROFILE_WINDOW) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Count the bytes of a sequence in one histogram, and profile it in windows of window bases.
+
+    Returns the histogram (256 counts), the GC content of each window in percent (uint8), and the GC skew
+    (G - C) / (G + C) of each window in percent (int8). The last window may be shorter.
+    """
+    data = np.frombuffer(sequence, dtype=np.uint8)
+    histogram = np.bincount(data, minlength=256)
+    if len(data) == 0:
+        return histogram, np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int8)
+
+    starts = np.arange(0, len(data), window)
+    codes = GC_CODES[data]
+    g = np.add.reduceat(codes == 1, starts, dtype=np.int64)
+    c = np.add.reduceat(codes == 2, starts, dtype=np.int64)
+    lengths = np.diff(np.append(starts, len(data)))
+    gc = np.rint(100 * (g + c) / lengths).astype(np.uint8)
+    skew = np.rint(100 * (g - c) / np.maximum(g + c, 1)).astype(np.int8)
+    return histogram, gc, skew
+
+
+def count_atgc(histogram: np.ndarray) -> {str: int}:
+    """Number of A, T, G and C in a byte histogram, including soft-masked ones"""
+    return {base: int(histogram[ord(base)] + histogram[ord(base.lower())]) for base in 'ATGC'}
+
+
+def sequence_issues(histogram: np.ndarray) -> {str: int}:
+    """Number of lowercase, N, other IUPAC and invalid characters in a byte histogram, if any"""
+    counts = np.bincount(BYTE_CLASSES, weights=histogram, minlength=len(CLASS_NAMES))
+    return {name: int(n) for name, n in zip(CLASS_NAMES[1:], counts[1:]) if n}
+
+
+def validate_sequence(sequence: bytes) -> {str: int}:
+    """sequence_issues() of a sequence, from a single histogram of its bytes"""
+    return sequence_issues(np.bincount(np.frombuffer(sequence, dtype=np.uint8), minlength=256))
+
+
+def format_issues(issues: {str: int}) -> str:
+    return ', '.join(f'{n:,} {name}' for name, n in issues.items()) + ' characters'
@@ -80,7 +80,7 @@ def create_headers(sample, contig_groups: [ContigGroup]) -> [str]:
         if cureated_headers[contig_id] != data['header']:
             data['header'] = cureated_headers[contig_id]
         markdown += f"{data['header']}\n"
-        markdown += f"{data['contig'].sequence[0:20]}...\n"
+        markdown += f"{data['contig'].encode_sequence()[0:20].decode('ascii')}...\n"
     markdown += '```'
 
     put_markdown(markdown)
@@ -6,6 +6,8 @@ from tempfile import TemporaryDirectory
 import pandas as pd
 from Bio.Seq import reverse_complement
 
+from assembly_curator.FastaReader import FastaReader
+
 CPU_COUNT = os.cpu_count()
 
 MESSAGE_DICT = {
@@ -15,14 +17,9 @@ MESSAGE_DICT = {
 
 
 def read_fasta(fasta_file) -> dict:
-    # returns {header: {header: header, seq: sequence}}
-    with open(fasta_file) as f:
-        sequences = [s for s in f.read().lstrip().split('>') if s]
-    sequences = [s.split('\n', 1) for s in sequences]
-    sequences = [(h.split(' ', 1)[0], dict(header=h, seq=s)) for h, s in sequences]
-    contig_ids = set([s[0] for s in sequences])
-    assert len(contig_ids) == len(sequences), f"Non-unique contig_ids in {fasta_file}: {contig_ids=}"
-    return dict(sequences)
+    # returns {header: {header: header, seq: sequence}}; FastaReader asserts that the contig_ids are unique
+    with FastaReader(fasta_file) as reader:
+        return {h.split(' ', 1)[0]: dict(header=h, seq=s.decode('ascii')) for h, s in reader}
 
 
 def write_fasta(fasta: dict, output_file: str, replace_newlines: bool = True):
@@ -0,0 +1,85 @@
+import os
+import math
+
+from assembly_curator.ContigGroup import ContigGroup
+
+# Time budget per pair of contig groups, in seconds
+DOTPLOT_TIME_BUDGET = float(os.environ.get('DOTPLOT_TIME_BUDGET', '10'))
+# Contig groups up to this length may be plotted with exact k-mers (dotplots_rrwick) instead of minimap2
+KMER_ENGINE_MAX_LEN = int(os.environ.get('DOTPLOT_KMER_MAX_LEN', '500000'))
+
+KMER_IMAGE_MAX_PIXELS = 1000  # longest side of a k-mer dotplot image
+KMER_MIN, KMER_MAX = 12, 32
+RANDOM_KMER_HITS = 10_000  # acceptable number of k-mer matches expected by chance per pair
+SHORT_CONTIG_LEN = 10_000  # minimap2 needs smaller seeds for groups of short contigs
+
+MINIMAP2_PARAMS = ['-t', '1', '-N', '1000000', '-p', '0.000001', '--no-long-join']
+MINIMAP2_PARAMS_FAST = ['-t', '1', '-N', '1000', '-p', '0.001', '--no-long-join']
+
+# Rough single-core throughput, used to compare the engines against the time budget
+SECONDS_PER_BP_KMER = 6e-7
+SECONDS_PER_PIXEL_KMER = 5e-8
+SECONDS_PER_KMER_HIT = 1e-7
+SECONDS_PER_BP_MINIMAP2 = 2.5e-7
+SECONDS_PER_BP_MINIMAP2_FAST = 1.5e-7
+SECONDS_PER_CONTIG_MINIMAP2 = 0.005
+
+
+def choose_kmer(len_ref: int, len_qry: int) -> int:
+    """Smallest k-mer for which fewer than RANDOM_KMER_HITS matches are expected by chance"""
+    kmer = math.ceil(math.log(max(len_ref * len_qry / RANDOM_KMER_HITS, 1), 4))
+    return min(max(kmer, KMER_MIN), KMER_MAX)
+
+
+def estimate_kmer_seconds(len_ref: int, len_qry: int, kmer: int, bp_per_pixel: float) -> float:
+    pixels = (len_ref / bp_per_pixel) * (len_qry / bp_per_pixel)
+    random_hits = len_ref * len_qry / 4 ** kmer
+    return ((len_ref + len_qry) * SECONDS_PER_BP_KMER
+            + pixels * SECONDS_PER_PIXEL_KMER
+            + random_hits * SECONDS_PER_KMER_HIT)
+
+
+def estimate_minimap2_seconds(cg_ref: ContigGroup, cg_qry: ContigGroup, fast: bool) -> float:
+    seconds_per_bp = SECONDS_PER_BP_MINIMAP2_FAST if fast else SECONDS_PER_BP_MINIMAP2
+    n_contigs = len(cg_ref.contigs) + len(cg_qry.contigs)
+    return (len(cg_ref) + len(cg_qry)) * seconds_per_bp + n_contigs * SECONDS_PER_CONTIG_MINIMAP2
+
+
+def plan_pair(cg_ref: ContigGroup, cg_qry: ContigGroup, time_budget: float = DOTPLOT_TIME_BUDGET) -> dict:
+    """
+    Choose the dotplot engine and its parameters for a pair of contig groups.
+
+    Small groups (plasmids) are plotted with exact k-mers, which is more sensitive and fast for short sequences.
+    Larger groups are aligned with minimap2. If the estimated time exceeds the budget, the k-mer engine is
+    skipped and minimap2 reports fewer secondary alignments.
+    """
+    len_ref, len_qry = len(cg_ref), len(cg_qry)
+    plan = {'ref': cg_ref.id, 'qry': cg_qry.id, 'len_ref': len_ref, 'len_qry': len_qry,
+            'n_contigs_ref': len(cg_ref.contigs), 'n_contigs_qry': len(cg_qry.contigs),
+            'time_budget': time_budget}
+
+    if max(len_ref, len_qry) > KMER_ENGINE_MAX_LEN:
+        reason = f'a group is longer than {KMER_ENGINE_MAX_LEN}bp'
+    else:
+        kmer = choose_kmer(len_ref, len_qry)
+        bp_per_pixel = max(max(len_ref, len_qry) / KMER_IMAGE_MAX_PIXELS, 1)
+        estimate = estimate_kmer_seconds(len_ref, len_qry, kmer, bp_per_pixel)
+        if estimate <= time_budget:
+            return plan | {'engine': 'kmer', 'kmer': kmer, 'bp_per_pixel': bp_per_pixel,
+                           'estimated_seconds': estimate,
+                           'reason': f'both groups are at most {KMER_ENGINE_MAX_LEN}bp'}
+        reason = f'k-mer engine over budget ({estimate:.1f}s)'
+
+    # Groups of many short contigs need smaller seeds to produce any alignments
+    min_mean_contig_len = min(len_ref / len(cg_ref.contigs), len_qry / len(cg_qry.contigs))
+    kmer = 15 if min_mean_contig_len < SHORT_CONTIG_LEN else 28
+
+    params = MINIMAP2_PARAMS
+    estimate = estimate_minimap2_seconds(cg_ref, cg_qry, fast=False)
+    if estimate > time_budget:
+        params = MINIMAP2_PARAMS_FAST
+        estimate = estimate_minimap2_seconds(cg_ref, cg_qry, fast=True)
+        reason += ', sensitive minimap2 over budget'
+
+    return plan | {'engine': 'minimap2', 'kmer': kmer, 'params': [*params, '-k', str(kmer)],
+                   'estimated_seconds': estimate, 'reason': reason}
@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import shutil
+
+import numpy as np
+from PIL import Image
+
+# 'svg': one SVG per cluster, 'tiles': raster tiles per pair with a lightweight SVG overlay for the axes
+DOTPLOT_OUTPUT = os.environ.get('DOTPLOT_OUTPUT', 'svg').lower()
+assert DOTPLOT_OUTPUT in ['svg', 'tiles'], f'Unknown DOTPLOT_OUTPUT: {DOTPLOT_OUTPUT}'
+# Number of zoom levels, each doubling the resolution of the previous one
+DOTPLOT_TILE_LEVELS = int(os.environ.get('DOTPLOT_TILE_LEVELS', '4'))
+DOTPLOT_TILE_FORMAT = os.environ.get('DOTPLOT_TILE_FORMAT', 'png').lower()
+assert DOTPLOT_TILE_FORMAT in ['png', 'webp'], f'Unknown DOTPLOT_TILE_FORMAT: {DOTPLOT_TILE_FORMAT}'
+
+TILE_SIZE = 256
+
+
+def write_tiles(image: np.ndarray, directory: str) -> [str]:
+    """Cut an RGBA image into tiles of TILE_SIZE, skipping transparent ones. Returns the names of the tiles."""
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for y in range(0, image.shape[0], TILE_SIZE):
+        for x in range(0, image.shape[1], TILE_SIZE):
+            tile = image[y:y + TILE_SIZE, x:x + TILE_SIZE]
+            if not tile[:, :, 3].any():
+                continue  # most of a dotplot is empty
+            name = f'{x // TILE_SIZE}-{y // TILE_SIZE}'
+            Image.fromarray(tile).save(os.path.join(directory, f'{name}.{DOTPLOT_TILE_FORMAT}'))
+            names.append(name)
+    return names
+
+
+def write_pair_tiles(tiles_dir: str, axes: [(str, int, int, bool)], rasterize) -> dict:
+    """
+    Write the tile pyramid of one pair of contig groups.
+
+    rasterize(level) returns the RGBA image of the pair at a zoom level. axes lists the subplots that show it as
+    (gid, row, col, transposed): the upper triangle shows the transposed image of the lower one.
+    Returns the manifest entries of the subplots, keyed by gid.
+    """
+    entries = {gid: {'row': row, 'col': col, 'sizes': [], 'tiles': []} for gid, row, col, _ in axes}
+    for level in range(DOTPLOT_TILE_LEVELS):
+        image = rasterize(level)
+        for gid, row, col, transposed in axes:
+            level_image = image.transpose(1, 0, 2) if transposed else image
+            entries[gid]['sizes'].append(level_image.shape[1::-1])  # width, height
+            entries[gid]['tiles'].append(
+                write_tiles(level_image, os.path.join(tiles_dir, f'{row}-{col}', str(level))))
+    return entries
+
+
+def reset_tiles(tiles_dir: str):
+    if os.path.isdir(tiles_dir):
+        shutil.rmtree(tiles_dir)
+    os.makedirs(tiles_dir)
+
+
+def write_manifest(tiles_dir: str, axes: dict):
+    """tiles.json tells assemblies.js where to place the tiles in the SVG overlay"""
+    with open(os.path.join(tiles_dir, 'tiles.json'), 'w') as f:
+        json.dump({
+            'version': time.time_ns() // 1000,  # appended to the tile URLs, which may then be cached indefinitely
+            'tile_size': TILE_SIZE,
+            'format': DOTPLOT_TILE_FORMAT,
+            'levels': DOTPLOT_TILE_LEVELS,
+            'axes': axes
+        }, f)
+
+
+def bump_manifest_version(tiles_dir: str):
+    """New tile URLs for tiles that were moved, e.g. to another cluster"""
+    path = os.path.join(tiles_dir, 'tiles.json')
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['version'] = time.time_ns() // 1000
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
@@ -1,25 +1,71 @@
 import json
 import time
 import os
-import glob
+import logging
 import subprocess
 import tempfile
+import itertools
 from datetime import timedelta
+from collections import OrderedDict
 
-import pandas as pd
+import numpy as np
 
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib import pyplot as plt, gridspec, ticker
+from matplotlib.path import Path
+from matplotlib.collections import PathCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
 
 from assembly_curator.utils import human_bp
 from assembly_curator.Contig import Contig
 from assembly_curator.ContigGroup import ContigGroup
+from assembly_curator.AlignmentCache import AlignmentCache
+from assembly_curator.SequenceStore import SequenceStore
+from assembly_curator.dotplot_planner import plan_pair
+from assembly_curator.dotplots_rrwick import kmer_dotplot_image, get_all_kmer_positions
+from assembly_curator.dotplot_tiles import DOTPLOT_OUTPUT, write_pair_tiles, reset_tiles, write_manifest
+
+try:
+    import mappy
+except ImportError:
+    mappy = None  # fall back to the minimap2 executable
 
 matplotlib.use('SVG')
 mnl = ticker.MaxNLocator(nbins=4, prune='upper')
 fmt = ticker.FuncFormatter(lambda x, pos: human_bp(x, decimals=0, zero_val='0'))
 
+# 'mappy': build one in-memory index per contig group, 'subprocess': run the minimap2 executable for each pair
+MINIMAP2_BACKEND = os.environ.get('MINIMAP2_BACKEND', 'mappy' if mappy is not None else 'subprocess').lower()
+assert MINIMAP2_BACKEND in ['mappy', 'subprocess'], f'Unknown MINIMAP2_BACKEND: {MINIMAP2_BACKEND}'
+if MINIMAP2_BACKEND == 'mappy' and mappy is None:
+    raise ImportError('MINIMAP2_BACKEND=mappy requires the mappy package')
+
+# Hits of one pair of contig groups. Minus-strand query coordinates are swapped, i.e. queryStart > queryEnd.
+HITS_DTYPE = np.dtype([
+    ('queryLen', np.int32), ('queryStart', np.int32), ('queryEnd', np.int32), ('strand', np.int8),
+    ('refLen', np.int32), ('refStart', np.int32), ('refEnd', np.int32),
+    ('numResidueMatches', np.int32), ('lenAln', np.int32), ('mapQ', np.uint8), ('primary', np.bool_)
+])
+# PAF columns that are stored as they are
+PAF_INT_COLUMNS = {'queryLen': 1, 'queryStart': 2, 'queryEnd': 3, 'refLen': 6, 'refStart': 7, 'refEnd': 8,
+                   'numResidueMatches': 9, 'lenAln': 10, 'mapQ': 11}
+PAF_CHUNK_LINES = 100_000  # lines parsed at once, bounds the memory used for text
+
+# Size of the cells (in output pixels) in which minimap2 hits are merged and thinned out before plotting, 0 draws all
+DOTPLOT_DECIMATION = float(os.environ.get('DOTPLOT_DECIMATION', '1'))
+SVG_DPI = 72  # user units per inch in matplotlib's SVG output
+
+MM_F_NO_LJOIN = 0x400  # minimap2.h: --no-long-join
+
+# Maximum size of the alignment cache in the samples directory, 0 disables it
+ALIGNMENT_CACHE_MB = float(os.environ.get('ALIGNMENT_CACHE_MB', '1024'))
+
+# Number of minimap2 indexes / k-mer tables each worker process keeps in memory
+DOTPLOT_INDEX_CACHE_SIZE = int(os.environ.get('DOTPLOT_INDEX_CACHE_SIZE', '4'))
+
 
 def run_minimap(ref, qry, out, params=[]):
     # Run minimap2 with the -o option to specify the output file
@@ -34,33 +80,159 @@ def run_minimap(ref, qry, out, params=[]):
     return cmd
 
 
+def mappy_kwargs(params: [str]) -> dict:
+    """
+    Translate minimap2 command line options to mappy.Aligner keyword arguments.
+
+    Known deviation: mappy.Aligner has no argument for -p (the minimum secondary-to-primary score ratio, pri_ratio
+    in mm_mapopt_t), so the in-process backend keeps minimap2's default of 0.8. With MINIMAP2_PARAMS
+    ('-p 0.000001'), the subprocess backend reports weaker secondary hits, e.g. of short repeats, that mappy drops.
+    Alignments of both backends are cached apart. Set MINIMAP2_BACKEND=subprocess to get them.
+    """
+    kwargs = {}
+    options = {'-k': ('k', int), '-w': ('w', int), '-N': ('best_n', int), '-t': ('n_threads', int), '-x': ('preset', str)}
+    params = list(params)
+    while params:
+        param = params.pop(0)
+        if param in options:
+            key, cast = options[param]
+            kwargs[key] = cast(params.pop(0))
+        elif param == '--no-long-join':
+            kwargs['extra_flags'] = kwargs.get('extra_flags', 0) | MM_F_NO_LJOIN
+        elif param == '-p':
+            # Not settable through mappy, see above
+            logging.debug(f'mappy: ignoring unsupported option {param} {params.pop(0)}')
+        else:
+            logging.debug(f'mappy: ignoring unsupported option {param}')
+    return kwargs
+
+
+def write_fasta(cg: ContigGroup, fasta: str):
+    # One record: the concatenated contigs
+    with open(fasta, 'w') as f:
+        f.write(f'>{cg.id}\n')
+        f.write(cg.sequence)
+
+
+def build_aligner(cg_ref: ContigGroup, params: [str]) -> 'mappy.Aligner':
+    aligner = mappy.Aligner(seq=cg_ref.sequence, **mappy_kwargs(params))
+    if not aligner:
+        raise RuntimeError(f'mappy failed to build the index for {cg_ref.id}')
+    return aligner
+
+
+def run_mappy(aligner: 'mappy.Aligner', cg_ref: ContigGroup, cg_qry: ContigGroup) -> np.ndarray:
+    """Map the query contig group against an in-memory index and return the hits like parse_minimap_output"""
+    ref_len, qry_len = len(cg_ref.sequence), len(cg_qry.sequence)
+    rows = [(
+        qry_len,
+        # minimap2 reports query coordinates on the forward strand: swap them for '-' like parse_minimap_output
+        hit.q_st if hit.strand > 0 else hit.q_en, hit.q_en if hit.strand > 0 else hit.q_st,
+        hit.strand,
+        ref_len, hit.r_st, hit.r_en,
+        hit.mlen, hit.blen, hit.mapq, hit.is_primary
+    ) for hit in aligner.map(cg_qry.sequence)]
+    return np.array(rows, dtype=HITS_DTYPE)
+
+
 def reverse_complement(seq):
     complement = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
     return ''.join(complement[base] for base in reversed(seq))
 
 
-def parse_minimap_output(minimap_output):
-    # Define column names
-    columns = ["queryID", "queryLen", "queryStart", "queryEnd", "strand", "refID", "refLen", "refStart", "refEnd",
-               "numResidueMatches", "lenAln", "mapQ", "alnType"]
-
-    # Read the minimap output into a pandas DataFrame
-    if os.stat(minimap_output).st_size==0:
-        return pd.DataFrame(columns=columns)
-    df = pd.read_csv(minimap_output, sep='\t', header=None)
+def parse_paf_lines(lines: [str]) -> np.ndarray:
+    ints = np.loadtxt(lines, delimiter='\t', comments=None, usecols=list(PAF_INT_COLUMNS.values()),
+                      dtype=np.int64, ndmin=2)
+    strand_type = np.loadtxt(lines, delimiter='\t', comments=None, usecols=(4, 12), dtype='S6', ndmin=2)
 
-    # Remove the columns that are not needed
-    df = df.iloc[:, :len(columns)]
-    df.columns = columns
+    hits = np.empty(len(lines), dtype=HITS_DTYPE)
+    for k, name in enumerate(PAF_INT_COLUMNS):
+        hits[name] = ints[:, k]
+    hits['strand'] = np.where(strand_type[:, 0] == b'+', 1, -1)
+    hits['primary'] = strand_type[:, 1] == b'tp:A:P'
 
     # if strand is '-', swap queryStart and queryEnd
-    df.loc[df.strand == '-', ['queryStart', 'queryEnd']] = df.loc[df.strand == '-', ['queryEnd', 'queryStart']].values
-
-    return df
+    minus = hits['strand'] < 0
+    hits['queryStart'][minus], hits['queryEnd'][minus] = hits['queryEnd'][minus], hits['queryStart'][minus]
+    return hits
+
+
+def parse_minimap_output(minimap_output) -> np.ndarray:
+    """Read a PAF file into a HITS_DTYPE array, PAF_CHUNK_LINES lines at a time"""
+    chunks = []
+    with open(minimap_output) as f:
+        while lines := list(itertools.islice(f, PAF_CHUNK_LINES)):
+            chunks.append(parse_paf_lines(lines))
+    if not chunks:
+        return np.empty(0, dtype=HITS_DTYPE)
+    return np.concatenate(chunks)
+
+
+def decimate(hits: np.ndarray, cell: float) -> np.ndarray:
+    """
+    Reduce the hits to what is visible at a resolution of cell bp:
+      1) merge collinear hits on the same (anti-)diagonal that are less than one cell apart
+      2) drop hits shorter than one cell
+      3) keep only the strongest hit per strand for each cell (by the position of its midpoint)
+    """
+    if len(hits) == 0 or cell <= 0:
+        return hits
+
+    # 1) Collinear hits share a diagonal: refStart - queryStart for '+', refStart + queryStart for '-'
+    ref_start, qry_start = hits['refStart'].astype(np.int64), hits['queryStart'].astype(np.int64)
+    diagonal = np.round((ref_start - hits['strand'] * qry_start) / cell).astype(np.int64)
+    order = np.lexsort((ref_start, diagonal, hits['strand']))
+    hits, diagonal = hits[order], diagonal[order]
+    new_diagonal = np.ones(len(hits), dtype=bool)
+    new_diagonal[1:] = (diagonal[1:] != diagonal[:-1]) | (hits['strand'][1:] != hits['strand'][:-1])
+    # Running maximum of refEnd within each diagonal: offset each diagonal so that the maxima do not leak
+    diagonal_id = np.cumsum(new_diagonal)
+    offset = diagonal_id * (int(hits['refLen'].max()) + 1)
+    running_end = np.maximum.accumulate(hits['refEnd'] + offset) - offset
+    new_run = new_diagonal.copy()
+    new_run[1:] |= hits['refStart'][1:] > running_end[:-1] + cell
+    starts = np.flatnonzero(new_run)
+
+    merged = hits[starts]  # sorted by refStart: the first hit of a run starts it
+    merged['refEnd'] = np.maximum.reduceat(hits['refEnd'], starts)
+    # A run ends where its hit with the largest refEnd ends. Hits that were not merged keep their own queryEnd
+    run_id = np.cumsum(new_run) - 1
+    by_end = np.lexsort((hits['refEnd'], run_id))
+    merged['queryEnd'] = hits['queryEnd'][by_end[np.append(starts[1:], len(hits)) - 1]]
+    merged['numResidueMatches'] = np.add.reduceat(hits['numResidueMatches'], starts)
+    merged['lenAln'] = np.add.reduceat(hits['lenAln'], starts)
+    merged['mapQ'] = np.maximum.reduceat(hits['mapQ'], starts)
+    merged['primary'] = np.maximum.reduceat(hits['primary'], starts)
+
+    # 2) Hits shorter than a cell
+    length = np.maximum(merged['refEnd'] - merged['refStart'], np.abs(merged['queryEnd'] - merged['queryStart']))
+    merged = merged[length >= cell]
+
+    # 3) Strongest hit per strand and cell, primary hits first
+    ref_cell = ((merged['refStart'] + merged['refEnd']) // 2 / cell).astype(np.int64)
+    qry_cell = ((merged['queryStart'] + merged['queryEnd']) // 2 / cell).astype(np.int64)
+    order = np.lexsort((-merged['numResidueMatches'], ~merged['primary'], qry_cell, ref_cell, merged['strand']))
+    key = np.stack([merged['strand'][order], ref_cell[order], qry_cell[order]], axis=1)
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (key[1:] != key[:-1]).any(axis=1)
+    return merged[np.sort(order[first])]
+
+
+def segments_to_path(segments: np.ndarray) -> Path:
+    """Turn an (n, 2, 2) array of line segments into a single path of n disconnected lines"""
+    codes = np.tile([Path.MOVETO, Path.LINETO], len(segments)).astype(Path.code_type)
+    return Path(segments.reshape(-1, 2), codes)
+
+
+def segments_to_collection(segments_fwd: np.ndarray, segments_rev: np.ndarray, linewidth: float) -> PathCollection:
+    return PathCollection(
+        [segments_to_path(segments_fwd), segments_to_path(segments_rev)],
+        facecolors='none', edgecolors=['blue', 'red'], linewidths=linewidth, capstyle='projecting'
+    )
 
 
 def create_dotplot(
-        df,
+        hits: np.ndarray,
         title=None,
         ax=None, ax2=None,
         cg_ref: ContigGroup = None, cg_qry: ContigGroup = None,
@@ -70,38 +242,39 @@ def create_dotplot(
     if ax is None:
         fig, ax = plt.subplots(figsize=figsize)
 
-    def plot_one_ax(rs, re, qs, qe, color, linewidth):
-        ax.plot(
-            [rs, re], [qs, qe],
-            color=color,
-            linewidth=linewidth
-        )
-
-    def plot_two_ax(rs, re, qs, qe, color, linewidth):
-        ax.plot(
-            [rs, re], [qs, qe],
-            color=color,
-            linewidth=linewidth
-        )
-        ax2.plot(
-            [qs, qe], [rs, re],
-            color=color,
-            linewidth=linewidth
-        )
-
-    plotting_fn = plot_one_ax if ax2 is None else plot_two_ax
-
-    df = df.sort_values('alnType', ascending=False)  # show primary alignments on top
-
-    # Plot alignments
-    for _, row in df.iterrows():
-        plotting_fn(
-            row['refStart'], row['refEnd'], row['queryStart'], row['queryEnd'],
-            color='blue' if row['strand'] == '+' else 'red',
-            linewidth=2 if row.alnType == 'tp:A:P' else 1
-        )
-
-    # Add separators
+    # Draw secondary alignments first so that primary alignments are shown on top
+    primary = hits['primary']
+    forward = hits['strand'] > 0
+    # Segments as (n, 2, 2) array: [[refStart, queryStart], [refEnd, queryEnd]]
+    segments = np.stack([
+        np.stack([hits['refStart'], hits['queryStart']], axis=1),
+        np.stack([hits['refEnd'], hits['queryEnd']], axis=1)
+    ], axis=1).astype(float)
+    for is_primary, linewidth in [(False, 1), (True, 2)]:
+        mask = primary == is_primary
+        if not mask.any():
+            continue
+        # One compound path per strand: a few SVG elements instead of one per hit
+        segments_fwd, segments_rev = segments[mask & forward], segments[mask & ~forward]
+        ax.add_collection(segments_to_collection(segments_fwd, segments_rev, linewidth))
+        if ax2:
+            # The upper triangle shows the same hits with reference and query swapped
+            ax2.add_collection(segments_to_collection(segments_fwd[:, :, ::-1], segments_rev[:, :, ::-1], linewidth))
+    ax.autoscale_view()  # no-op if the limits were set by draw_pair
+
+    add_separators(ax, ax2, cg_ref, cg_qry)
+
+    if title is not None:
+        ax.set_xlabel('Reference Position')
+        ax.set_ylabel('Query Position')
+        ax.set_title(title)
+    if show:
+        plt.show()
+
+    return ax
+
+
+def add_separators(ax, ax2, cg_ref: ContigGroup, cg_qry: ContigGroup):
     running_sum = 0
     for c in cg_ref.contigs:
         running_sum += len(c)
@@ -115,17 +288,35 @@ def create_dotplot(
         if ax2:
             ax2.axvline(running_sum, color='black', linewidth=1)
 
-    if title is not None:
-        ax.set_xlabel('Reference Position')
-        ax.set_ylabel('Query Position')
-        ax.set_title(title)
-    if show:
-        plt.show()
-
-    return ax
-
 
-def dotplot_minimap2(ax, ax2, out, cg_ref: ContigGroup, cg_qry: ContigGroup, params) -> plt.Axes:
+def align(
+        cg_ref: ContigGroup, cg_qry: ContigGroup, params,
+        get_aligner=None, cache: AlignmentCache = None
+) -> np.ndarray:
+    if cache is not None:
+        key = cache.key(cg_ref.sequence_hash, cg_qry.sequence_hash, params, MINIMAP2_BACKEND)
+        hits = cache.get(key)
+        if hits is not None:
+            return hits
+
+    if MINIMAP2_BACKEND == 'mappy':
+        hits = run_mappy(get_aligner(), cg_ref, cg_qry)
+    else:
+        # The minimap2 executable needs files
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cg_ref.fasta, cg_qry.fasta = os.path.join(tmpdir, 'ref.fasta'), os.path.join(tmpdir, 'qry.fasta')
+            write_fasta(cg_ref, cg_ref.fasta)
+            write_fasta(cg_qry, cg_qry.fasta)
+            out = os.path.join(tmpdir, 'out.paf')
+            cmd = run_minimap(ref=cg_ref, qry=cg_qry, params=params, out=out)
+            hits = parse_minimap_output(out)
+
+    if cache is not None:
+        cache.put(key, hits)
+    return hits
+
+
+def set_limits(ax, ax2, cg_ref: ContigGroup, cg_qry: ContigGroup):
     ax.set_xlim(0, len(cg_ref))
     ax.set_ylim(0, len(cg_qry))
     ax.invert_yaxis()
@@ -135,9 +326,41 @@ def dotplot_minimap2(ax, ax2, out, cg_ref: ContigGroup, cg_qry: ContigGroup, par
         ax2.set_ylim(0, len(cg_ref))
         ax2.invert_yaxis()
 
-    cmd = run_minimap(ref=cg_ref, qry=cg_qry, params=params, out=out)
-    df = parse_minimap_output(out)
-    return create_dotplot(df, ax=ax, ax2=ax2, cg_ref=cg_ref, cg_qry=cg_qry)
+
+def draw_kmer_image(ax, ax2, cg_ref: ContigGroup, cg_qry: ContigGroup, image: np.ndarray) -> plt.Axes:
+    """Plot exact k-mer matches (dotplots_rrwick) as an image in bp coordinates"""
+    ax.imshow(image, extent=(0, len(cg_ref), len(cg_qry), 0), aspect='auto')
+    if ax2:
+        ax2.imshow(image.transpose(1, 0, 2), extent=(0, len(cg_qry), len(cg_ref), 0), aspect='auto')
+    set_limits(ax, ax2, cg_ref, cg_qry)
+    add_separators(ax, ax2, cg_ref, cg_qry)
+    return ax
+
+
+def draw_pair(ax, ax2, cg_ref: ContigGroup, cg_qry: ContigGroup, fragment: dict) -> plt.Axes:
+    if 'image' in fragment:
+        return draw_kmer_image(ax, ax2, cg_ref, cg_qry, fragment['image'])
+    set_limits(ax, ax2, cg_ref, cg_qry)
+    return create_dotplot(fragment['hits'], ax=ax, ax2=ax2, cg_ref=cg_ref, cg_qry=cg_qry)
+
+
+def rasterize_pair(cg_ref: ContigGroup, cg_qry: ContigGroup, fragment: dict, bp_per_pixel: float) -> np.ndarray:
+    """Draw the lower-triangle plot of a pair without axes, as RGBA image with a transparent background"""
+    width, height = round(len(cg_ref) / bp_per_pixel), round(len(cg_qry) / bp_per_pixel)
+    if 'image' in fragment:
+        # Scaling the k-mer image directly is much faster than going through matplotlib
+        return np.asarray(Image.fromarray(fragment['image']).resize((width, height), Image.Resampling.NEAREST))
+
+    fig = Figure(figsize=(width / SVG_DPI, height / SVG_DPI), dpi=SVG_DPI)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_axis_off()
+    if 'hits' in fragment:
+        fragment = fragment | {'hits': decimate(fragment['hits'], DOTPLOT_DECIMATION * bp_per_pixel)}
+    draw_pair(ax, None, cg_ref, cg_qry, fragment)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
 
 
 def format_axis(ax, i, j, n_ctgs, x_label: str, y_label: str):
@@ -166,28 +389,90 @@ def format_ticks(ax, len_seq1, len_seq2):
     ax.tick_params(axis='y', labelsize=8)
 
 
-def create_dotplots(
-        workdir: str,
+def load_contig_group(data: dict, store: SequenceStore = None) -> ContigGroup:
+    """Rebuild a contig group from ContigGroup.to_json, with its sequence from the store"""
+    cg = ContigGroup.from_json(data)
+    if store is not None:
+        cg.sequence = store.get(cg.id)
+        cg.sequence_hash = store.hash(cg.id)
+    return cg
+
+
+def plan_pairs(cgs: [ContigGroup], params=None) -> [(int, int, dict)]:
+    """All pairs (i <= j) of a cluster with the engine chosen by dotplot_planner, unless params are given"""
+    return [
+        (i, j, plan_pair(cgs[i], cgs[j]) if params is None else {'engine': 'minimap2', 'params': params})
+        for i in range(len(cgs)) for j in range(i, len(cgs))
+    ]
+
+
+def get_alignment_cache(cache_dir: str = None) -> AlignmentCache | None:
+    if cache_dir is None or ALIGNMENT_CACHE_MB <= 0:
+        return None
+    return AlignmentCache(cache_dir, max_size=int(ALIGNMENT_CACHE_MB * 1024 ** 2))
+
+
+# Indexes of recently used contig groups, kept per worker process:
+# pairs with the same reference often end up on the same worker
+_indexes = OrderedDict()
+
+
+def get_index(key: tuple, build):
+    if key in _indexes:
+        _indexes.move_to_end(key)
+    else:
+        _indexes[key] = build()
+        while len(_indexes) > DOTPLOT_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return _indexes[key]
+
+
+def compute_pair(
+        store: SequenceStore, ref: dict, qry: dict, i: int, j: int, plan: dict, cache_dir: str = None
+) -> dict:
+    """
+    Compute the dotplot of contig groups i and j of a cluster, given as ContigGroup.to_json.
+    Returns a fragment that render_dotplots draws: the minimap2 hits or the k-mer image, plus the plan and the
+    time it took.
+    """
+    start = time.time()
+    try:
+        cg_ref = load_contig_group(ref, store)
+        cg_qry = cg_ref if i == j else load_contig_group(qry, store)
+    finally:
+        if store.attached:
+            store.close()  # the sequences were copied out of the store
+
+    if plan['engine'] == 'kmer':
+        ref_kmers = get_index(('kmer', cg_ref.sequence_hash, plan['kmer']),
+                              lambda: get_all_kmer_positions(plan['kmer'], cg_ref.sequence))
+        fragment = {'image': kmer_dotplot_image(cg_ref.sequence, cg_qry.sequence, plan['kmer'], plan['bp_per_pixel'],
+                                                ref_kmers)}
+    else:
+        params = plan['params']
+        get_aligner = lambda: get_index(('mappy', cg_ref.sequence_hash, tuple(params)),
+                                        lambda: build_aligner(cg_ref, params))
+        fragment = {'hits': align(cg_ref, cg_qry, params, get_aligner, get_alignment_cache(cache_dir))}
+
+    return fragment | {'i': i, 'j': j, 'plan': plan | {'seconds': time.time() - start}}
+
+
+def render_dotplots(
+        cgs: [dict],
+        fragments: [dict],
         figsize: (int, int) = (10, 10),
         title: str = None,
-        output: str = 'dotplots.png',
-        params=None
+        output: str = 'dotplots.svg',
+        save_plan: bool = True
 ):
-    if params is None:
-        params = [
-            '-t', '1',
-            '-k', '28',
-            '-N', '1000000',
-            '-p', '0.000001',
-            '--no-long-join',
-        ]
+    """
+    Composite the fragments computed by compute_pair into one figure with a subplot per pair.
+    If DOTPLOT_OUTPUT is 'tiles', the pairs are written as raster tiles to a directory named like the output,
+    e.g. cluster1/, and the SVG only contains the axes.
+    """
     plt.rcParams['svg.fonttype'] = 'none'
 
-    cgs = []
-    for cg_json in glob.glob(os.path.join(workdir, '*.json')):
-        cg = ContigGroup.from_json(cg_json)
-        cg.fasta = cg_json.replace('.json', '.fasta')
-        cgs.append(cg)
+    cgs = [load_contig_group(data) for data in cgs]
     n_cgs = len(cgs)
 
     # Calculate the relative width of each subplot
@@ -196,47 +481,93 @@ def create_dotplots(
 
     fig = plt.figure(figsize=figsize)
     gs = gridspec.GridSpec(n_cgs, n_cgs, width_ratios=subplot_ratios, height_ratios=subplot_ratios)
+    padding, space = 0.05, 0.1
 
-    for i in range(n_cgs):
-        cg_i = cgs[i]
-        for j in range(n_cgs):
-            cg_j = cgs[j]
-            if i == j:
-                ax = fig.add_subplot(gs[i, j], gid=f'dotplot - {cg_j.id} - {cg_i.id}')
-                # start = time.time()
-                dotplot_minimap2(ax, None, os.path.join(workdir, f'{i}-{j}.mm2'), cg_i, cg_j, params)
-                format_axis(ax, i, j, n_cgs, cg_i.id, cg_j.id)
-                format_ticks(ax, len(cg_i), len(cg_j))
-                if len(cg_j.contigs) == 1 and cg_j.contigs[0].topology == 'circular':
-                    ax.set_facecolor('lightgreen')  # circular
-                # diff = time.time() - start
-            elif i < j:
-                # Add the dotplot to lower triangle
-                ax1 = fig.add_subplot(gs[j, i], gid=f'dotplot - {cg_j.id} - {cg_i.id}')
-                ax2 = fig.add_subplot(gs[i, j], gid=f'dotplot - {cg_i.id} - {cg_j.id}')
-                # start = time.time()
-                dotplot_minimap2(ax1, ax2, os.path.join(workdir, f'{i}-{j}.mm2'), cg_i, cg_j, params)
-                format_axis(ax1, j, i, n_cgs, cg_i.id, cg_j.id)
-                format_ticks(ax1, len(cg_i), len(cg_j))
-                format_axis(ax2, i, j, n_cgs, cg_j.id, cg_i.id)
-                format_ticks(ax2, len(cg_j), len(cg_i))
-                # diff = time.time() - start
-            else:
-                continue
-            # print('TIMING-MM2:', cg_i.id, n_cgs, cg_j.id, len(cg_j), diff)
+    # All subplots have the same scale: the axes share the figure width minus padding and spacing
+    axes_width = figsize[0] * SVG_DPI * (1 - 2 * padding) / (1 + space * (n_cgs - 1) / n_cgs)
+    bp_per_pixel = total_length / axes_width
+    n_hits, n_drawn = 0, 0
+
+    tiles_dir, tiles = None, {}
+    if DOTPLOT_OUTPUT == 'tiles':
+        tiles_dir = os.path.splitext(output)[0]
+        reset_tiles(tiles_dir)
+
+    fragments = sorted(fragments, key=lambda f: (f['i'], f['j']))
+    for fragment in fragments:
+        i, j = fragment['i'], fragment['j']
+        cg_i, cg_j = cgs[i], cgs[j]
+        if tiles_dir is not None:
+            axes = [(f'dotplot - {cg_j.id} - {cg_i.id}', j, i, False)]
+            if i != j:
+                axes.append((f'dotplot - {cg_i.id} - {cg_j.id}', i, j, True))
+            tiles |= write_pair_tiles(tiles_dir, axes, lambda level: rasterize_pair(
+                cg_i, cg_j, fragment, bp_per_pixel / 2 ** level))
+        if 'hits' in fragment:
+            hits = decimate(fragment['hits'], DOTPLOT_DECIMATION * bp_per_pixel)
+            n_hits, n_drawn = n_hits + len(fragment['hits']), n_drawn + len(hits)
+            fragment['plan'] |= {'hits': len(fragment['hits']), 'hits_drawn': len(hits)}
+            fragment = fragment | {'hits': hits}
+        if tiles_dir is not None:
+            fragment = {'hits': np.empty(0, dtype=HITS_DTYPE)}  # only draw the axes
+        if i == j:
+            ax = fig.add_subplot(gs[i, j], gid=f'dotplot - {cg_j.id} - {cg_i.id}')
+            draw_pair(ax, None, cg_i, cg_j, fragment)
+            format_axis(ax, i, j, n_cgs, cg_i.id, cg_j.id)
+            format_ticks(ax, len(cg_i), len(cg_j))
+            if len(cg_j.contigs) == 1 and cg_j.contigs[0].topology == 'circular':
+                ax.set_facecolor('lightgreen')  # circular
+        else:
+            # Add the dotplot to lower triangle
+            ax1 = fig.add_subplot(gs[j, i], gid=f'dotplot - {cg_j.id} - {cg_i.id}')
+            ax2 = fig.add_subplot(gs[i, j], gid=f'dotplot - {cg_i.id} - {cg_j.id}')
+            draw_pair(ax1, ax2, cg_i, cg_j, fragment)
+            format_axis(ax1, j, i, n_cgs, cg_i.id, cg_j.id)
+            format_ticks(ax1, len(cg_i), len(cg_j))
+            format_axis(ax2, i, j, n_cgs, cg_j.id, cg_i.id)
+            format_ticks(ax2, len(cg_j), len(cg_i))
 
     if title:
         fig.suptitle(title, fontsize=16)
 
-    padding, space = 0.05, 0.1
     plt.subplots_adjust(left=padding, right=1 - padding, top=1 - padding, bottom=padding, wspace=space, hspace=space)
-    plt.savefig(output, format='svg')
+    plt.savefig(output, format='svg', metadata={
+        'Description': f'decimation={DOTPLOT_DECIMATION}px bp_per_pixel={bp_per_pixel:.1f} '
+                       f'hits={n_hits} hits_drawn={n_drawn}'
+    })
     plt.close()
 
+    if tiles_dir is not None:
+        write_manifest(tiles_dir, tiles)
+
+    if save_plan:
+        with open(f'{os.path.splitext(output)[0]}.plan.json', 'w') as f:
+            json.dump([fragment['plan'] for fragment in fragments], f, indent=2)
+
+
+def create_dotplots(
+        cgs: [ContigGroup],
+        figsize: (int, int) = (10, 10),
+        title: str = None,
+        output: str = 'dotplots.svg',
+        params=None,
+        cache_dir: str = None
+):
+    """
+    Plot all pairs of contig groups. If params is None, the engine and its parameters are chosen per pair by
+    dotplot_planner and the decisions are saved next to the output, e.g. cluster1.plan.json.
+    """
+    store = SequenceStore({cg.id: b''.join(cg.encode_sequences()) for cg in cgs})
+    try:
+        data = [cg.to_json() for cg in cgs]
+        fragments = [compute_pair(store, data[i], data[j], i, j, plan, cache_dir)
+                     for i, j, plan in plan_pairs(cgs, params)]
+    finally:
+        store.unlink()
+    if (cache := get_alignment_cache(cache_dir)) is not None:
+        cache.evict()
+    render_dotplots(data, fragments, figsize, title, output, save_plan=params is None)
 
-def process_cluster(cluster_id, workdir, dotplot_outdir):
-    create_dotplots(workdir, output=os.path.join(dotplot_outdir, f'{cluster_id}.svg'))
-    return cluster_id
 
 # with open('data/15_N/lja/assembly.fasta') as f:
 #     seq = f.read()
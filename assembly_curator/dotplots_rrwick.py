@@ -1,12 +1,13 @@
 import os
 import time
 import logging
-import collections
+import numpy as np
 from PIL import Image, ImageDraw, ImageColor
 from matplotlib import pyplot as plt, gridspec, ticker
 
 from assembly_curator.utils import human_bp
 from assembly_curator.ContigGroup import ContigGroup
+from assembly_curator.FastaReader import FastaReader
 
 mnl = ticker.MaxNLocator(nbins=4, prune='upper')
 
@@ -17,26 +18,26 @@ REV_COMP_DICT = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G', 'a': 't', 't': 'a', 'g'
                  '?': '?'}
 
 
+INVALID_BASE = 4
+BASE_CODES = np.full(256, INVALID_BASE, dtype=np.uint8)
+for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for base in bases:
+        BASE_CODES[ord(base)] = code
+
+# Bounds the memory used for expanding k-mer matches into (i, j) positions
+MAX_HITS_PER_BATCH = 10_000_000
+
+
 def reverse_complement(seq):
     return ''.join([REV_COMP_DICT.get(base, 'N') for base in seq][::-1])
 
 
 def extract_contig(fasta_path: str, contig_id: str) -> str:
-    sequence = ''
-    with open(fasta_path) as f:
-        append = False
-        for line in f:
-            if line.startswith('>'):
-                id = line.split(' ', 1)[0].strip('>\n')
-                append = (id == contig_id)
-                if append:
-                    sequence = ''
-                continue
-            if append:
-                sequence += line.strip()
+    with FastaReader(fasta_path) as reader:
+        sequence = reader.sequence(contig_id) if contig_id in reader else b''
     if not sequence:
         raise ValueError(f'Error: Contig {contig_id} not found in {fasta_path}')
-    return sequence
+    return sequence.decode('ascii')
 
 
 def load_contig_sequence(fasta_and_contig: str) -> dict[str, str]:
@@ -113,7 +114,7 @@ def create_dotplots(
     plt.rcParams['svg.fonttype'] = 'none'
 
     # Calculate the total length of all sequences
-    seq_lengths = [sum(len(c.sequence) for c in cg.contigs) for cg in cgs]
+    seq_lengths = [sum(len(c) for c in cg.contigs) for cg in cgs]
     total_length = sum(seq_lengths)
 
     # Calculate the relative width of each subplot
@@ -123,15 +124,15 @@ def create_dotplots(
     gs = gridspec.GridSpec(len(cgs), len(cgs), width_ratios=relative_widths, height_ratios=relative_widths)
 
     for i, cg_i in enumerate(cgs):
-        seq1 = ''.join(c.sequence for c in cg_i.contigs)
-        sep1 = [0] + [len(contig.sequence) for contig in cg_i.contigs]
+        seq1 = b''.join(cg_i.encode_sequences()).decode('ascii')
+        sep1 = [0] + [len(contig) for contig in cg_i.contigs]
 
         start_i = time.time()
         a_forward_kmers, a_reverse_kmers = get_all_kmer_positions(config.kmer, seq1)
         diff_i = time.time() - start_i
         for j, cg_j in enumerate(cgs):
-            seq2 = ''.join(c.sequence for c in cg_j.contigs)
-            sep2 = [0] + [len(contig.sequence) for contig in cg_j.contigs]
+            seq2 = b''.join(cg_j.encode_sequences()).decode('ascii')
+            sep2 = [0] + [len(contig) for contig in cg_j.contigs]
 
             if i == j:
                 start_j = time.time()
@@ -181,49 +182,144 @@ def create_dotplot(
         a_forward_kmers, a_reverse_kmers,
         config: DotplotConfig
 ):
-    image = Image.new(
-        mode='RGB',
-        size=[int(round(len(seq) / config.bp_per_pixel)) for seq in [seq_a, seq_b]],
-        color=config.background_colour
-    )
+    width, height = [int(round(len(seq) / config.bp_per_pixel)) for seq in [seq_a, seq_b]]
+
+    # Mark the pixels hit by at least one k-mer, separately for both strands
+    hits_fwd = np.zeros((height, width), dtype=bool)
+    hits_rev = np.zeros((height, width), dtype=bool)
+    # Sorted queries make the binary searches in find_kmer_hits cache-friendly
+    b_kmers, b_positions = index_kmers(*encode_kmers(encode_sequence(seq_b), config.kmer))
+    for hits, a_kmers in [(hits_rev, a_reverse_kmers), (hits_fwd, a_forward_kmers)]:
+        for i, j in find_kmer_hits(a_kmers, b_kmers, b_positions):
+            i_pixel = np.rint(i / config.bp_per_pixel).astype(np.int64)
+            j_pixel = np.rint(j / config.bp_per_pixel).astype(np.int64)
+            in_bounds = (i_pixel < width) & (j_pixel < height)
+            hits[j_pixel[in_bounds], i_pixel[in_bounds]] = True
+
+    # Each hit is drawn as a small cross, forward hits on top of reverse hits
+    canvas = np.zeros((height, width), dtype=np.uint8)
+    canvas[dilate(hits_rev)] = 1
+    canvas[dilate(hits_fwd)] = 2
+    if config.background_colour is None:  # transparent
+        palette = np.array([(0, 0, 0, 0), (*config.color_rev, 255), (*config.color_fwd, 255)], dtype=np.uint8)
+    else:
+        palette = np.array([
+            ImageColor.getrgb(config.background_colour), config.color_rev, config.color_fwd
+        ], dtype=np.uint8)
+    image = Image.fromarray(palette[canvas])
     draw = ImageDraw.Draw(image)
 
-    def draw_dot(i, j, colour):
-        draw.point((i, j), fill=colour)
-        draw.point((i + 1, j), fill=colour)
-        draw.point((i - 1, j), fill=colour)
-        draw.point((i, j + 1), fill=colour)
-        draw.point((i, j - 1), fill=colour)
-
-    for j in range(len(seq_b) - config.kmer + 1):
-        j_pixel = int(round(j / config.bp_per_pixel))
-        k = seq_b[j:j + config.kmer]
-        if k in a_reverse_kmers:
-            for i in a_reverse_kmers[k]:
-                i_pixel = int(round(i / config.bp_per_pixel))
-                draw_dot(i_pixel, j_pixel, config.color_rev)
-
-        if k in a_forward_kmers:
-            for i in a_forward_kmers[k]:
-                i_pixel = int(round(i / config.bp_per_pixel))
-                draw_dot(i_pixel, j_pixel, config.color_fwd)
-
     add_separators(image, draw, sep_a, sep_b, config)
 
     return image, draw
 
 
+def kmer_dotplot_image(
+        seq_ref: str, seq_qry: str,
+        kmer: int, bp_per_pixel: float,
+        ref_kmers=None,
+        color_fwd='blue', color_rev='red'
+) -> np.ndarray:
+    """
+    RGBA k-mer dotplot with a transparent background: the reference on the x-axis, the query on the y-axis.
+
+    ref_kmers may be passed to reuse the output of get_all_kmer_positions(kmer, seq_ref) for several queries.
+    """
+    config = DotplotConfig(
+        kmer=kmer, bp_per_pixel=bp_per_pixel, background_colour=None,
+        color_fwd=ImageColor.getrgb(color_fwd), color_rev=ImageColor.getrgb(color_rev),
+        line_color=ImageColor.getrgb('black')
+    )
+    if ref_kmers is None:
+        ref_kmers = get_all_kmer_positions(kmer, seq_ref)
+    image, draw = create_dotplot(seq_ref, seq_qry, [], [], *ref_kmers, config)
+    return np.asarray(image)
+
+
+def dilate(mask: np.ndarray) -> np.ndarray:
+    """Expand every pixel to a cross of five pixels"""
+    dilated = mask.copy()
+    dilated[1:, :] |= mask[:-1, :]
+    dilated[:-1, :] |= mask[1:, :]
+    dilated[:, 1:] |= mask[:, :-1]
+    dilated[:, :-1] |= mask[:, 1:]
+    return dilated
+
+
+def encode_sequence(seq: str) -> np.ndarray:
+    """Encode a sequence as an array of 2-bit base codes, non-ACGT characters become INVALID_BASE"""
+    return BASE_CODES[np.frombuffer(seq.encode('ascii'), dtype=np.uint8)]
+
+
+def encode_kmers(codes: np.ndarray, kmer_size: int) -> (np.ndarray, np.ndarray):
+    """
+    Pack all k-mers of an encoded sequence into 64-bit integers.
+
+    Returns the k-mers and their positions. K-mers that contain a non-ACGT base are skipped.
+    """
+    assert 0 < kmer_size <= 32, f'kmer must be between 1 and 32, not {kmer_size}'
+    n_kmers = len(codes) - kmer_size + 1
+    if n_kmers <= 0:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    kmers = np.zeros(n_kmers, dtype=np.uint64)
+    for offset in range(kmer_size):
+        kmers <<= np.uint64(2)
+        kmers |= codes[offset:offset + n_kmers] & 3
+
+    # A k-mer is valid if the window contains no invalid base
+    n_invalid = np.concatenate([[0], np.cumsum(codes == INVALID_BASE)])
+    positions = np.flatnonzero(n_invalid[kmer_size:] == n_invalid[:n_kmers])
+    return kmers[positions], positions
+
+
+def find_kmer_hits(a_kmers: (np.ndarray, np.ndarray), b_kmers: np.ndarray, b_positions: np.ndarray,
+                   max_hits: int = MAX_HITS_PER_BATCH):
+    """
+    Find all positions i in sequence a and j in sequence b that share a k-mer.
+
+    Yields (i, j) arrays in batches of at most max_hits hits, unless a single k-mer of b has more hits.
+    """
+    a_sorted, a_positions = a_kmers
+    left = np.searchsorted(a_sorted, b_kmers, side='left')
+    counts = np.searchsorted(a_sorted, b_kmers, side='right') - left
+    found = counts > 0
+    left, counts, b_positions = left[found], counts[found], b_positions[found]
+    cumulative = np.cumsum(counts)
+
+    start = 0
+    while start < len(counts):
+        done = cumulative[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(cumulative, done + max_hits, side='right')))
+        batch_counts = counts[start:end]
+        n_hits = int(batch_counts.sum())
+        # For every hit: index of the first match of its k-mer in a_sorted, plus the offset within the matches
+        offsets = np.arange(n_hits) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        i = a_positions[np.repeat(left[start:end], batch_counts) + offsets]
+        j = np.repeat(b_positions[start:end], batch_counts)
+        yield i, j
+        start = end
+
+
+def index_kmers(kmers: np.ndarray, positions: np.ndarray) -> (np.ndarray, np.ndarray):
+    order = np.argsort(kmers, kind='stable')
+    return kmers[order], positions[order]
+
+
 def get_all_kmer_positions(kmer_size, seq):
-    forward_kmers, reverse_kmers = collections.defaultdict(list), collections.defaultdict(list)
-    rev_comp_seq = reverse_complement(seq)
+    """
+    Index all k-mers of seq for lookups with find_kmer_hits.
+
+    The reverse index contains the reverse complement of each k-mer at its position on the forward strand.
+    """
+    codes = encode_sequence(seq)
+    forward_kmers = index_kmers(*encode_kmers(codes, kmer_size))
+
+    rev_comp_codes = np.where(codes == INVALID_BASE, INVALID_BASE, 3 - codes).astype(np.uint8)[::-1]
+    kmers, positions = encode_kmers(rev_comp_codes, kmer_size)
     seq_len = len(seq) - kmer_size + 1
-    for i in range(seq_len):
-        k = seq[i:i + kmer_size]
-        forward_kmers[k].append(i)
-        k = rev_comp_seq[i:i + kmer_size]
-        reverse_kmers[k].append(seq_len - i - 1)
-    assert len(forward_kmers) < len(seq)
-    assert len(reverse_kmers) < len(seq)
+    reverse_kmers = index_kmers(kmers, seq_len - positions - 1)
+
     return forward_kmers, reverse_kmers
 
 # import logging
@@ -27,7 +27,8 @@ def run_huey(
     huey_consumer = huey.create_consumer(
         workers=n_workers,
         worker_type=WORKER_PROCESS,  # Has to be separate processes. Threading is not supported by matplotlib
-        periodic=False
+        periodic=False,
+        flush_locks=True  # locks of tasks that were running when the previous consumer died
     )
     huey_consumer.run()
 
@@ -1,10 +1,17 @@
 import os
+import time
+import logging
 import dill
+from huey.exceptions import TaskLockedException
 
 from assembly_curator.huey_config import get_huey
-from assembly_curator.main_base import process_sample
+from assembly_curator.main_base import process_sample, recluster_sample
+from assembly_curator.phylogenetic_tree import calculate_phylogenetic_tree, read_tree_progress, write_tree_progress, \
+    TREE_TIMEOUT
 
 huey = get_huey()
+# Created on import, so that the consumer flushes it on startup if a previous consumer died holding it
+tree_lock = huey.lock_task('calculate_tree')
 
 _importers = None
 
@@ -37,3 +44,42 @@ def process_assembly(sample, sample_dir):
     # delete processingif it exists
     if os.path.isfile(f"{sample_dir}/processing"):
         os.remove(f"{sample_dir}/processing")
+
+
+@huey.task()
+def calculate_tree(samples_dir):
+    importers = load_importers()
+
+    def progress(step, done, total):
+        write_tree_progress(samples_dir, 'running', step, done, total)
+
+    def calculate():
+        with tree_lock:
+            progress('Listing samples', 0, 0)
+            try:
+                calculate_phylogenetic_tree(importers, samples_dir, progress=progress)
+            except Exception:
+                write_tree_progress(samples_dir, 'failed')
+                raise
+
+    try:
+        calculate()
+    except TaskLockedException:
+        state = read_tree_progress(samples_dir)
+        if state['state'] == 'running' and time.time() - state['updated'] < TREE_TIMEOUT:
+            # Already being calculated: samples added meanwhile are noticed by the next overview request
+            return
+        # The holder stopped reporting progress, e.g. its worker was killed: it is not coming back
+        logging.warning(f'Tree lock held without progress for {TREE_TIMEOUT}s, taking it over')
+        huey.flush_locks('calculate_tree')
+        try:
+            calculate()
+        except TaskLockedException:
+            return  # another task took it over first, and wrote its progress
+    write_tree_progress(samples_dir, 'done')
+
+
+@huey.task()
+def recluster(sample, sample_dir, cutoff, threshold):
+    recluster_sample(sample, sample_dir, load_importers(), cutoff=cutoff, threshold=threshold)
+    return True  # None would mean the task has not finished yet
@@ -3,17 +3,27 @@ import sys
 import shutil
 import json
 import logging
+import atexit
 import tempfile
+import threading
 from typing import List, Type
 import multiprocessing as mp
 import importlib.resources as pkg_resources
 
+import dill
+import pandas as pd
+
 from assembly_curator.ContigGroup import ContigGroup
-from assembly_curator.dotplots_minimap2 import process_cluster
-from assembly_curator.utils import AssemblyFailedException, rgb_array_to_css, css_escape
-from assembly_curator.ani_dendrogram import ani_clustermap, add_cluster_info_to_assemblies
+from assembly_curator.dotplots_minimap2 import compute_pair, render_dotplots, plan_pairs, get_alignment_cache
+from assembly_curator.dotplot_tiles import DOTPLOT_OUTPUT, bump_manifest_version
+from assembly_curator.utils import AssemblyFailedException, rgb_array_to_css, css_escape, get_cache_dir
+from assembly_curator.ani_dendrogram import ani_clustermap, add_cluster_info_to_assemblies, ANI_CUTOFF, \
+    CLUSTER_THRESHOLD
+from assembly_curator.SketchStore import SketchStore
 from assembly_curator.Assembly import Assembly
+from assembly_curator.SequenceStore import SequenceStore
 from assembly_curator.AssemblyImporter import AssemblyImporter
+from assembly_curator.composition import format_issues
 
 from jinja2 import Environment, PackageLoader, select_autoescape
 
@@ -31,6 +41,25 @@ template_assemblies_css = env.get_template('assemblies_dynamic.css.jinja2')
 GC_LOW = float(os.environ.get('GC_LOW', '25')) / 100
 GC_HIGH = float(os.environ.get('GC_HIGH', '65')) / 100
 
+# Size of the process pool shared by the dotplots of all samples
+DOTPLOT_WORKERS = int(os.environ.get('DOTPLOT_WORKERS', mp.cpu_count()))
+
+_dotplot_pool = None
+_dotplot_pool_lock = threading.Lock()  # requests of the threaded Flask server may ask for the pool concurrently
+
+
+def get_dotplot_pool() -> mp.Pool:
+    """
+    Long-lived pool for dotplot work. It is created on first use and reused by all following samples, so that the
+    workers (and the indexes they keep in memory) survive between samples.
+    """
+    global _dotplot_pool
+    with _dotplot_pool_lock:
+        if _dotplot_pool is None:
+            _dotplot_pool = mp.Pool(DOTPLOT_WORKERS)
+            atexit.register(_dotplot_pool.terminate)
+    return _dotplot_pool
+
 
 def process_sample(
         sample: str,
@@ -63,9 +92,13 @@ def process_sample(
         ).dump(f"{sample_dir}/assemblies.html")
         return []
 
+    clustering = {'cutoff': ANI_CUTOFF, 'threshold': CLUSTER_THRESHOLD}
     similarity_matrix, cluster_to_color, cg_to_cluster = ani_clustermap(
         assemblies=assemblies,
-        fname=f"{sample_dir}/assembly-curator/ani_clustermap.svg"
+        fname=f"{sample_dir}/assembly-curator/ani_clustermap.json",
+        **clustering,
+        sketch_store=SketchStore(get_cache_dir(os.path.dirname(os.path.abspath(sample_dir)), 'sketches')),
+        scope=f'sample-{sample}'
     )
     similarity_matrix.to_csv(f'{sample_dir}/assembly-curator/assemblies_pyskani_similarity_matrix.tsv', sep='\t')
 
@@ -74,26 +107,131 @@ def process_sample(
     # cluster_to_color =
     create_all_dotplots(assemblies, sample_dir)
 
+    write_sample_outputs(sample, sample_dir, assemblies, messages, cluster_to_color, cg_to_cluster, clustering)
+
+    return assemblies
+
+
+def write_sample_outputs(sample: str, sample_dir: str, assemblies: [Assembly], messages: list,
+                         cluster_to_color: dict, cg_to_cluster: dict, clustering: dict):
     json_data = {assembly.assembler: assembly.to_json() for assembly in assemblies}
 
     with open(f"{sample_dir}/assembly-curator/assemblies.json", 'w') as f:
         json.dump(json_data, f, indent=2)
 
+    # Kept to render the page again after reclustering, without the importers
+    with open(f"{sample_dir}/assembly-curator/messages.json", 'w') as f:
+        json.dump([{'message': str(m), 'severity': getattr(m, 'severity', 'danger')} for m in messages], f)
+    with open(f"{sample_dir}/assembly-curator/clustering.json", 'w') as f:
+        json.dump(clustering, f)
+
     template_assemblies.stream(
         messages=messages,
         sample=sample,
         assemblies=assemblies,
         cluster_to_color={cluster_id: rgb_array_to_css(color) for cluster_id, color in cluster_to_color.items()},
         cg_to_cluster=cg_to_cluster,
+        clustering=clustering,
+        dotplot_tiles=DOTPLOT_OUTPUT == 'tiles',
     ).dump(f"{sample_dir}/assemblies.html")
 
     template_assemblies_css.stream(
         assemblies=assemblies
     ).dump(f"{sample_dir}/assembly-curator/assemblies_dynamic.css")
 
+
+def recluster_sample(
+        sample: str,
+        sample_dir: str,
+        importers: List[Type[AssemblyImporter]],
+        cutoff: float = ANI_CUTOFF,
+        threshold: float = CLUSTER_THRESHOLD
+) -> [Assembly]:
+    """
+    Cluster a processed sample again with other cutoffs, from its saved similarity matrix.
+
+    Only the dotplots of clusters whose contig groups changed are drawn again, the others are renamed if needed.
+    The assemblies are taken from assemblies.pkl if the web interface saved them, otherwise they are imported again.
+    """
+    outdir = f"{sample_dir}/assembly-curator"
+    matrix_file = f'{outdir}/assemblies_pyskani_similarity_matrix.tsv'
+    assert os.path.isfile(matrix_file), f"Sample {sample} has not been processed yet"
+
+    pickle_file = f"{outdir}/assemblies.pkl"
+    if os.path.isfile(pickle_file):
+        with open(pickle_file, 'rb') as f:
+            assemblies = dill.load(f)
+    else:
+        assemblies, _ = load_assemblies(sample, sample_dir, importers)
+    try:
+        with open(f"{outdir}/messages.json") as f:
+            messages = [AssemblyFailedException(m['message'], m['severity']) for m in json.load(f)]
+    except FileNotFoundError:
+        messages = []
+
+    # Clusters before reclustering, by their contig groups
+    with open(f"{outdir}/assemblies.json") as f:
+        old_cg_to_cluster = {cg_id: cg['cluster_id'] for assembly in json.load(f).values()
+                             for cg_id, cg in assembly['contig_groups'].items()}
+    old_members = {}
+    for cg_id, cluster_id in old_cg_to_cluster.items():
+        old_members.setdefault(cluster_id, set()).add(cg_id)
+    members_to_old = {frozenset(members): cluster_id for cluster_id, members in old_members.items()}
+
+    similarity_matrix = pd.read_csv(matrix_file, sep='\t', index_col=0)
+    clustering = {'cutoff': cutoff, 'threshold': threshold}
+    similarity_matrix, cluster_to_color, cg_to_cluster = ani_clustermap(
+        assemblies=assemblies,
+        fname=f"{outdir}/ani_clustermap.json",
+        **clustering,
+        similarity_matrix=similarity_matrix
+    )
+    add_cluster_info_to_assemblies(assemblies, cluster_to_color, cg_to_cluster)
+
+    new_members = {}
+    for cg_id, cluster_id in cg_to_cluster.items():
+        new_members.setdefault(cluster_id, set()).add(cg_id)
+    renames = {members_to_old[frozenset(members)]: cluster_id for cluster_id, members in new_members.items()
+               if frozenset(members) in members_to_old}
+    changed = [cluster_id for cluster_id in new_members if cluster_id not in renames.values()]
+    logging.info(f"Reclustered {sample}: {len(new_members)} clusters, {len(changed)} changed")
+
+    dotplot_outdir = os.path.join(outdir, 'dotplots')
+    rename_dotplots(dotplot_outdir, renames)
+    if changed:
+        create_all_dotplots(assemblies, sample_dir, clusters=changed)
+
+    write_sample_outputs(sample, sample_dir, assemblies, messages, cluster_to_color, cg_to_cluster, clustering)
+    if os.path.isfile(pickle_file):
+        with open(pickle_file, 'wb') as f:
+            dill.dump(assemblies, f)
+
     return assemblies
 
 
+def rename_dotplots(dotplot_outdir: str, renames: {str: str}):
+    """Rename the dotplots of clusters (old -> new id) and remove those of all other clusters"""
+    tmp_dir = tempfile.mkdtemp(dir=dotplot_outdir)
+    for old in renames:
+        for suffix in ['.svg', '.plan.json', '']:  # '': directory of the tiles
+            if os.path.exists(os.path.join(dotplot_outdir, old + suffix)):
+                os.replace(os.path.join(dotplot_outdir, old + suffix), os.path.join(tmp_dir, old + suffix))
+    for entry in os.scandir(dotplot_outdir):
+        if entry.path == tmp_dir:
+            continue
+        elif entry.is_dir():
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+    for old, new in renames.items():
+        for suffix in ['.svg', '.plan.json', '']:
+            if os.path.exists(os.path.join(tmp_dir, old + suffix)):
+                os.replace(os.path.join(tmp_dir, old + suffix), os.path.join(dotplot_outdir, new + suffix))
+        if old != new and os.path.isdir(os.path.join(dotplot_outdir, new)):
+            bump_manifest_version(os.path.join(dotplot_outdir, new))  # the browser may cache the old tiles of new
+    os.rmdir(tmp_dir)
+
+
 def load_assemblies(
         sample: str,
         sample_dir: str,
@@ -135,53 +273,83 @@ def load_assemblies(
                 elif contig.gc_rel > GC_HIGH:
                     messages.append(AssemblyFailedException(
                         f"High GC content above {GC_HIGH * 100:.2f} ({contig.gc_rel * 100:.2f}%) for {contig.id}"))
+                if contig.sequence_issues:
+                    messages.append(AssemblyFailedException(
+                        f"{format_issues(contig.sequence_issues)} in {contig.id}", 'warning'))
 
     return assemblies, messages
 
 
-def create_all_dotplots(assemblies, sample_dir: str):
+def create_all_dotplots(assemblies, sample_dir: str, clusters: [str] = None):
+    """Dotplots of all clusters, or only of the given ones"""
     dotplot_outdir = os.path.join(sample_dir, 'assembly-curator', 'dotplots')
     os.makedirs(dotplot_outdir, exist_ok=True)
-    cgs = {cg.id: cg for assembly in assemblies for cg in assembly.contig_groups}
+    samples_dir = os.path.dirname(os.path.abspath(sample_dir))
+    cache_dir = get_cache_dir(samples_dir, 'alignments')
+    cgs = {cg.id: cg for assembly in assemblies for cg in assembly.contig_groups
+           if clusters is None or cg.cluster_id in clusters}
 
     cluster_to_color = {cg.cluster_id: cg.cluster_color for cg in cgs.values()}
 
-    tmpdirs = {}
-    cluster_to_cgs = {}
-    for cluster_id in cluster_to_color:
-        cluster_cgs = [cg for cg in cgs.values() if cg.cluster_id == cluster_id]
-        cluster_to_cgs[cluster_id] = cluster_cgs
-        tmpdir = tempfile.TemporaryDirectory()
-        for i, cg in enumerate(cluster_cgs):
-            with open(os.path.join(tmpdir.name, f'cg_{i}.json'), 'w') as f:
-                json.dump(cg.to_json(), f, indent=4)
-            with open(os.path.join(tmpdir.name, f'cg_{i}.fasta'), 'w') as f:
-                f.write(f'>{cg.id}\n')
-                for c in cg.contigs:
-                    f.write(c.sequence)
-        tmpdirs[cluster_id] = tmpdir
-
-        # start_mm2 = time.time()
-        # create_dotplots_minimap2(cluster_cgs, output=os.path.join(dotplot_outdir, f'{cluster_id}.svg'))
-        # delta_mm2 = time.time() - start_mm2
+    cluster_to_cgs = {
+        cluster_id: [cg for cg in cgs.values() if cg.cluster_id == cluster_id] for cluster_id in cluster_to_color
+    }
+    # Workers get the metadata as JSON and the sequences from shared memory
+    cluster_to_json = {
+        cluster_id: [cg.to_json() for cg in cluster_cgs] for cluster_id, cluster_cgs in cluster_to_cgs.items()
+    }
+    store = SequenceStore({cg.id: b''.join(cg.encode_sequences()) for cg in cgs.values()},
+                          spill_dir=get_cache_dir(samples_dir, 'sequences'))
+
+    # Split the clusters into pairs of contig groups: the chromosome cluster alone has more pairs than most
+    # machines have cores, while the plasmid clusters are cheap
+    cluster_to_pairs = {
+        cluster_id: plan_pairs(cluster_to_cgs[cluster_id]) for cluster_id in cluster_to_color
+    }
+    outputs = {cluster_id: os.path.join(dotplot_outdir, f'{cluster_id}.svg') for cluster_id in cluster_to_color}
 
     MULTIPROCESSING = os.environ.get('MULTIPROCESSING_DOTPLOTS', 'FALSE').lower() == 'true'
-    if MULTIPROCESSING:
-        with mp.Pool(mp.cpu_count()) as pool:
-            pool.starmap(
-                func=process_cluster,
-                iterable=[(cluster_id, tmpdirs[cluster_id].name, dotplot_outdir) for cluster_id in cluster_to_color])
-    else:
-        for cluster_id in cluster_to_color:
-            process_cluster(cluster_id, tmpdirs[cluster_id].name, dotplot_outdir)
-
-    # cleanup
-    for tmpdir in tmpdirs.values():
-        tmpdir.cleanup()
+    try:
+        plot_pairs(store, cluster_to_json, cluster_to_pairs, outputs, cache_dir, MULTIPROCESSING)
+    finally:
+        store.unlink()
+    if (cache := get_alignment_cache(cache_dir)) is not None:
+        cache.evict()
 
     return cluster_to_color
 
 
+def plot_pairs(store: SequenceStore, cluster_to_json: dict, cluster_to_pairs: dict, outputs: dict,
+               cache_dir: str, multiprocessing: bool):
+    if multiprocessing:
+        pool = get_dotplot_pool()
+        # Submit the most expensive pairs first so that they do not end up as stragglers
+        tasks = sorted(
+            ((cluster_id, i, j, plan) for cluster_id, pairs in cluster_to_pairs.items() for i, j, plan in pairs),
+            key=lambda task: task[3].get('estimated_seconds', 0), reverse=True
+        )
+        pair_results = {cluster_id: [] for cluster_id in cluster_to_pairs}
+        for cluster_id, i, j, plan in tasks:
+            cgs = cluster_to_json[cluster_id]
+            pair_results[cluster_id].append(pool.apply_async(
+                compute_pair, (store, cgs[i], cgs[j], i, j, plan, cache_dir)))
+
+        # Render each cluster as soon as its pairs are done, cheapest clusters first
+        render_results = []
+        for cluster_id in sorted(cluster_to_pairs, key=lambda c: sum(
+                plan.get('estimated_seconds', 0) for _, _, plan in cluster_to_pairs[c])):
+            fragments = [result.get() for result in pair_results[cluster_id]]
+            render_results.append(pool.apply_async(
+                render_dotplots, (cluster_to_json[cluster_id], fragments), {'output': outputs[cluster_id]}))
+        for result in render_results:
+            result.get()
+    else:
+        for cluster_id, pairs in cluster_to_pairs.items():
+            cgs = cluster_to_json[cluster_id]
+            fragments = [compute_pair(store, cgs[i], cgs[j], i, j, plan, cache_dir) for i, j, plan in pairs]
+            render_dotplots(cgs, fragments, output=outputs[cluster_id])
+
+
 def prepare_website(samples_dir: str, link: bool = True):
     def copy_or_link(src, dst):
         if os.path.isfile(dst):
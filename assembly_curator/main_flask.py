@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import shutil
 import logging
 from glob import glob
@@ -7,12 +8,14 @@ from typing import List, Type
 
 import socket
 
-from assembly_curator.phylogenetic_tree import calculate_phylogenetic_tree
+from assembly_curator.phylogenetic_tree import calculate_phylogenetic_tree, get_phylogenetic_tree, \
+    read_tree_progress, write_tree_progress, TREE_TIMEOUT
 
 socket.setdefaulttimeout(1000)  # seconds
 
 import dill
-from flask import Flask, send_from_directory, redirect, request, jsonify, abort
+from huey.exceptions import TaskException
+from flask import Flask, Response, send_from_directory, redirect, request, jsonify, abort
 from pywebio.output import put_text, put_html
 from pywebio.input import select, SELECT
 from pywebio.platform.flask import webio_view
@@ -21,8 +24,10 @@ from pywebio.session import eval_js
 from urllib.parse import urlparse, parse_qs
 
 from assembly_curator.ContigGroup import ContigGroup
-from assembly_curator.main_base import process_sample, prepare_website
-from assembly_curator.utils import load_importers, load_get_custom_html, get_relative_path, detach_process
+from assembly_curator.main_base import process_sample, prepare_website, recluster_sample
+from assembly_curator.ani_dendrogram import ANI_CUTOFF, CLUSTER_THRESHOLD
+from assembly_curator.utils import load_importers, load_get_custom_html, get_relative_path, detach_process, \
+    open_text
 from assembly_curator.Assembly import Assembly
 from assembly_curator.AssemblyImporter import AssemblyImporter
 from assembly_curator.contig_curator import *
@@ -32,6 +37,8 @@ importers: List[Type[AssemblyImporter]] = None
 get_custom_html = None
 
 process_assembly_huey = None
+calculate_tree_huey = None  # only set if Huey workers were started: otherwise the tree is calculated in the request
+recluster_huey = None  # likewise for reclustering
 assemblies: [Assembly] = None
 
 from jinja2 import Environment, PackageLoader, select_autoescape
@@ -43,6 +50,8 @@ env = Environment(
 )
 
 app = Flask(__name__)
+DOTPLOT_TILE_MAX_AGE = 365 * 24 * 3600  # seconds
+
 pywebio_html = """
 <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet"
       integrity="sha384-QWTKZyjpPEjISv5WaRU9OFeRpok6YctnYmDr5pNlyT2bRjXh0JMhjY6hW+ALEwIH" crossorigin="anonymous">
@@ -118,8 +127,15 @@ def serve_root():
     dirs, files, links = list_directory(samples_directory, '.', is_root=True)
 
     calculate_tree = True
+    tree_pending = False
     if calculate_tree:
-        samples = calculate_phylogenetic_tree(importers, samples_directory, force_rerun=False)
+        samples, tree_current = get_phylogenetic_tree(importers, samples_directory)
+        if not tree_current and calculate_tree_huey is None:
+            samples = calculate_phylogenetic_tree(importers, samples_directory, force_rerun=False)
+        elif not tree_current:
+            # Show the samples in alphabetical order until the tree is ready
+            schedule_phylogenetic_tree()
+            tree_pending = True
         folders = [f for f in dirs if f not in samples]
     else:
         samples, folders = dirs, []
@@ -130,6 +146,7 @@ def serve_root():
     return template_index.render(
         title='Overview',
         samples=samples,
+        tree_pending=tree_pending,
         folders=sorted(folders),
         files=sorted(files),
         links=sorted(links),
@@ -137,6 +154,20 @@ def serve_root():
     )
 
 
+def schedule_phylogenetic_tree(force: bool = False):
+    progress = read_tree_progress(samples_directory)
+    if (not force and progress['state'] in ['queued', 'running']
+            and time.time() - progress['updated'] < TREE_TIMEOUT):
+        return
+    write_tree_progress(samples_directory, 'queued')
+    calculate_tree_huey(samples_directory)
+
+
+@app.route('/tree_status', methods=['GET'])
+def tree_status():
+    return jsonify(read_tree_progress(samples_directory))
+
+
 def process_assembly(sample, sample_dir):
     assemblies = process_sample(sample, sample_dir, importers)
 
@@ -208,6 +239,39 @@ def get_status_endpoint():
     return jsonify(status)
 
 
+@app.route('/recluster_sample', methods=['POST'])
+def recluster_sample_endpoint():
+    sample_name = request.json.get('sample_name')
+    if not sample_name:
+        return jsonify({"error": "sample_name parameter is required"}), 400
+    if get_status(sample_name)['status'] not in ['preprocessed', 'finished']:
+        return jsonify({"error": f"{sample_name} is not processed yet"}), 409
+    sample_dir = os.path.join(samples_directory, sample_name)
+    cutoff = float(request.json.get('cutoff', ANI_CUTOFF))
+    threshold = float(request.json.get('threshold', CLUSTER_THRESHOLD))
+    if recluster_huey is not None:
+        task = recluster_huey(sample_name, sample_dir, cutoff, threshold)
+        return jsonify({'status': 'queued', 'task_id': task.id}), 202
+    try:
+        recluster_sample(sample_name, sample_dir, importers, cutoff=cutoff, threshold=threshold)
+    except Exception as e:
+        logging.exception(f'Failed to recluster {sample_name}')
+        return jsonify({"error": str(e)}), 500
+    return jsonify({'status': 'success'}), 200
+
+
+@app.route('/recluster_status', methods=['POST'])
+def recluster_status():
+    task_id = request.json.get('task_id')
+    if not task_id:
+        return jsonify({"error": "task_id parameter is required"}), 400
+    try:
+        result = huey.result(task_id, preserve=True)  # polled again by retried requests or other tabs
+    except TaskException as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({'status': 'queued' if result is None else 'success'}), 200
+
+
 @app.route('/toggle_failed', methods=['POST'])
 def toggle_failed():
     sample_name = request.json.get('sample_name')
@@ -260,6 +324,15 @@ def serve_path(filepath):
         sample = os.path.basename(dirname)
         return serve_assembly(samples_directory, sample)
 
+    # Compressed assembler outputs are served as if they were not, e.g. to assemblies.js
+    if not os.path.exists(full_path) and os.path.isfile(f'{full_path}.gz'):
+        def decompress():
+            with open_text(full_path) as f:
+                while chunk := f.read(1 << 20):
+                    yield chunk
+
+        return Response(decompress(), mimetype='text/plain')
+
     # If the path does not exist, try to use glob to get a path
     if not os.path.exists(full_path):
         _globresult = glob(full_path)
@@ -278,7 +351,11 @@ def serve_path(filepath):
             return send_from_directory('templates', 'assembly-curator.webp')
 
         extension = full_path.rsplit('.', 1)[-1]
-        mimetype, as_attachment = None, False
+        mimetype, as_attachment, max_age = None, False, None
+
+        # Dotplot tiles are requested with ?v=<version of tiles.json>: cache them for good
+        if extension in ['png', 'webp'] and '/dotplots/' in filepath and 'v' in request.args:
+            max_age = DOTPLOT_TILE_MAX_AGE
 
         if extension in ['fasta', 'tsv', 'gfa', 'gv']:
             mimetype = 'text/plain'
@@ -288,7 +365,7 @@ def serve_path(filepath):
         elif action == 'download':
             as_attachment = True
 
-        return send_from_directory(dirname, basename, as_attachment=as_attachment, mimetype=mimetype)
+        return send_from_directory(dirname, basename, as_attachment=as_attachment, mimetype=mimetype, max_age=max_age)
 
     # Serve directories
     elif os.path.isdir(full_path):
@@ -364,7 +441,7 @@ def run_server(
     assert os.path.isdir(samples_dir), f"Samples directory {samples_dir} does not exist"
     assert os.path.isdir(plugin_dir), f"Plugin directory {plugin_dir} does not exist"
 
-    global samples_directory, process_assembly_huey, huey
+    global samples_directory, process_assembly_huey, calculate_tree_huey, recluster_huey, huey
     samples_directory = samples_dir
 
     os.environ['HUEY_DB_PATH'] = os.path.join(samples_dir, 'huey.db')
@@ -372,7 +449,10 @@ def run_server(
 
     if n_workers > 0:
         from assembly_curator.huey_main import run_huey
+        from assembly_curator.huey_tasks import calculate_tree as calculate_tree_huey, recluster as recluster_huey
         detach_process(run_huey, samples_dir=samples_dir, plugin_dir=plugin_dir, n_workers=n_workers)
+        # Start on the tree before the first visitor asks for it
+        schedule_phylogenetic_tree(force=True)
 
     os.environ['MULTIPROCESSING_DOTPLOTS'] = 'TRUE'
 
@@ -1,130 +1,431 @@
 import os
 import re
 import json
+import time
+import heapq
 import logging
 from io import StringIO
 
 import pyskani
-from typing import Type
+from typing import Type, Callable
+import numpy as np
 import pandas as pd
 import scipy.cluster.hierarchy as sch
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
 import matplotlib as mpl
 
 mpl.use('SVG')
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
 from assembly_curator.AssemblyImporter import AssemblyImporter
+from assembly_curator.FastaReader import FastaReader
+from assembly_curator.composition import validate_sequence, format_issues
+from assembly_curator.SketchStore import SketchStore
+from assembly_curator.utils import get_cache_dir, compressed_path
+
+# Larger cohorts keep only the nearest neighbours of each sample instead of the full similarity matrix
+COHORT_DENSE_MAX_SAMPLES = int(os.environ.get('COHORT_DENSE_MAX_SAMPLES', '1000'))
+COHORT_NEIGHBOURS = int(os.environ.get('COHORT_NEIGHBOURS', '20'))
+
+SIMILARITY_MATRIX = 'similarity_matrix.tsv'
+SIMILARITY_NEIGHBOURS = 'similarity_matrix.neighbours.tsv'
+TREE_PLOT = 'similarity_matrix.svg'
+TREE_ORDER = 'similarity_matrix.json'
+# Assembly of each sample in the similarity matrix, to update only new or changed samples
+TREE_MANIFEST = 'similarity_matrix.manifest.json'
+# State of the background calculation, polled by the overview
+TREE_PROGRESS = 'similarity_matrix.progress.json'
+# A tree calculation whose progress was not updated for this long is assumed dead
+TREE_TIMEOUT = 600  # seconds
+
+Progress = Callable[[str, int, int], None]  # step, done, total
 
 
 def get_assembly(sample_dir, assembly_importer: AssemblyImporter):
-    fasta = os.path.join(sample_dir, assembly_importer.assembly_dir, assembly_importer.assembly)
+    fasta = compressed_path(os.path.join(sample_dir, assembly_importer.assembly_dir, assembly_importer.assembly))
     if os.path.isfile(fasta) and os.stat(fasta).st_size > 0:
         return fasta
 
 
-def get_sequences(fasta: str):
-    with open(fasta) as f:
-        data = f.read()
-    encoded_sequences = []
-    for entry in data.split('>'):
-        entry = entry.strip()
-        if entry == '': continue  # start or end of FASTA file
-        contig_header, sequence = entry.split('\n', 1)
-        sequence = sequence.replace('\n', '')
-        assert set(sequence) == {'A', 'T', 'C', 'G'}
-        encoded_sequences.append(sequence.encode('ascii'))
+def read_sequences(reader: FastaReader) -> [bytes]:
+    encoded_sequences = [sequence for _, sequence in reader]
+    issues = {}
+    for sequence in encoded_sequences:
+        assert sequence, f'Empty sequence in {reader.fasta}'
+        for name, n in validate_sequence(sequence).items():
+            issues[name] = issues.get(name, 0) + n
+    assert 'invalid' not in issues, f'Invalid characters in {reader.fasta}: {format_issues(issues)}'
+    if issues:
+        logging.warning(f'{reader.fasta}: {format_issues(issues)}')
     return encoded_sequences
 
 
-def calculate_similarity_matrix(samples_dir, importers):
+def get_sequences(fasta: str) -> [bytes]:
+    with FastaReader(fasta) as reader:
+        return read_sequences(reader)
+
+
+def find_candidates(sample_dir, importers: [Type[AssemblyImporter]]) -> {str: [int, int]}:
+    """
+    The assemblies that may represent a sample in the tree, with their modification time and size: the curated
+    hybrid.fasta if it was exported, otherwise the assembler outputs. Only looks at the file system.
+    """
+    hybrid = os.path.join(sample_dir, 'assembly-curator', 'hybrid.fasta')
+    if os.path.isfile(hybrid) and os.stat(hybrid).st_size > 0:
+        fastas = [hybrid]
+    else:
+        fastas = [fasta for fasta in (get_assembly(sample_dir, importer) for importer in importers) if fasta]
+    return {fasta: [(stat := os.stat(fasta)).st_mtime_ns, stat.st_size] for fasta in fastas}
+
+
+def read_representative_assembly(candidates: [str]) -> (str, [bytes]):
+    """
+    The candidate with the largest total sequence length, and its sequences: file sizes are not comparable once
+    some are compressed. Lengths come from the indices where they are current, and each FASTA is read at most once.
+    """
+    readers, lengths = {}, {}
+    try:
+        for fasta in candidates:
+            index = FastaReader.read_index(fasta) if len(candidates) > 1 else None
+            if index is None:
+                readers[fasta] = FastaReader(fasta)
+                index = readers[fasta].index
+            lengths[fasta] = sum(length for length, _, _, _ in index.values())
+        fasta = max(candidates, key=lengths.get)
+        if fasta not in readers:
+            readers[fasta] = FastaReader(fasta)
+        return fasta, read_sequences(readers[fasta])
+    finally:
+        for reader in readers.values():
+            reader.close()
+
+
+def find_assemblies(samples_dir: str, importers: [Type[AssemblyImporter]]) -> {str: dict}:
+    """The candidates for the representative assembly of each sample that has any"""
+    assemblies = {}
+    for sample in os.listdir(samples_dir):
+        candidates = find_candidates(os.path.join(samples_dir, sample), importers)
+        if candidates:
+            assemblies[sample] = {'candidates': candidates}
+    return assemblies
+
+
+def is_unchanged(entry: dict | None, assembly: dict) -> bool:
+    return entry is not None and all(entry.get(k) == v for k, v in assembly.items())
+
+
+def sketch_cohort(
+        samples_dir: str, assemblies: {str: dict}, manifest: {str: dict}, progress: Progress = None
+) -> (pyskani.Database, {str: [str]}, {str: [bytes]}, {str: dict}):
+    """
+    Read and sketch the samples that are new or changed compared to the manifest.
+    Returns the cohort database, its sketch names (sketch -> samples), the changed samples and the new manifest.
+    """
+    samples = list(assemblies)
+    samples_to_sequence, sketched, new_manifest = {}, {}, {}
+    touched = {}  # read, but identical to the previous run
+    for i, sample in enumerate(samples):
+        entry = manifest.get(sample)
+        if is_unchanged(entry, assemblies[sample]):
+            sketched[sample] = entry['hash']
+            new_manifest[sample] = entry
+            continue
+        logging.info(f"Reading assemblies: {i}/{len(samples)}")
+        if progress:
+            progress('Reading assemblies', i, len(samples))
+        fasta, sequences = read_representative_assembly(list(assemblies[sample]['candidates']))
+        new_manifest[sample] = assemblies[sample] | {'fasta': fasta, 'hash': SketchStore.key(sequences)}
+        if entry is not None and entry['hash'] == new_manifest[sample]['hash']:
+            sketched[sample] = entry['hash']
+            touched[sample] = sequences
+        else:
+            samples_to_sequence[sample] = sequences
+
+    # Only samples that changed since the last run are sketched
+    sketch_store = SketchStore(get_cache_dir(samples_dir, 'sketches'))
+    pyskani_db, names = sketch_store.database('cohort', samples_to_sequence, sketched=sketched, progress=progress)
+    missing = sketched.keys() - names.keys()
+    if missing:
+        logging.info(f"Sketches of {len(missing)} samples are missing, sketching them again")
+        for sample in missing:
+            del sketched[sample]
+            samples_to_sequence[sample] = touched.get(sample) or get_sequences(new_manifest[sample]['fasta'])
+        pyskani_db, names = sketch_store.database('cohort', samples_to_sequence, sketched=sketched, progress=progress)
+    for sample, name in names.items():
+        new_manifest[sample]['sketch'] = name
+    name_to_samples = {}
+    for sample, name in names.items():
+        name_to_samples.setdefault(name, []).append(sample)
+
+    return pyskani_db, name_to_samples, samples_to_sequence, new_manifest
+
+
+def calculate_similarity_matrix(
+        samples_dir: str,
+        assemblies: {str: dict},
+        manifest: {str: dict} = None,
+        previous: pd.DataFrame = None,
+        progress: Progress = None
+) -> (pd.DataFrame, {str: dict}):
+    """
+    Similarity of all samples, reusing the previous matrix for samples whose assembly is unchanged in the manifest.
+
+    Only new or changed samples are read, sketched and queried. Their similarity to unchanged samples is estimated
+    in one direction only, like skani triangle does; pairs of new samples are averaged over both directions.
+    Returns the matrix and the new manifest.
+    """
     logging.info(f"Calculating Phylogenetic tree...")
+    pyskani_db, name_to_samples, samples_to_sequence, manifest = sketch_cohort(
+        samples_dir, assemblies, manifest or {}, progress)
 
-    pyskani_db = pyskani.Database()
-
-    # create db
-    samples = os.listdir(samples_dir)
-    samples_to_sequence = {}
-    for i, sample in enumerate(samples):
-        logging.info(f"Creating pyskani db: {i}/{len(samples)}")
-        for importer in importers:
-            fasta = get_assembly(os.path.join(samples_dir, sample), importer)
-            if fasta is not None:
-                samples_to_sequence[sample] = get_sequences(fasta)
-                pyskani_db.sketch(sample, *samples_to_sequence[sample])
+    samples = list(assemblies)
+    index = {sample: i for i, sample in enumerate(samples)}
+    changed = np.isin(samples, list(samples_to_sequence))
 
-    # initiate similarity_matrix
-    similarity_matrix = pd.DataFrame(index=samples_to_sequence.keys(), columns=samples_to_sequence.keys(), data=0.0)
+    similarity = np.zeros((len(samples), len(samples)))
+    if previous is not None:
+        similarity[:] = previous.reindex(index=samples, columns=samples, fill_value=0.0).to_numpy()
+    similarity[changed, :] = 0
+    similarity[:, changed] = 0
 
     # fill values
+    queried = np.zeros_like(similarity)
     for i, (sample, sequence) in enumerate(samples_to_sequence.items()):
-        logging.info(f"Querying pyskani db: {i}/{len(samples)}")
+        logging.info(f"Querying pyskani db: {i}/{len(samples_to_sequence)}")
+        if progress:
+            progress('Querying pyskani db', i, len(samples_to_sequence))
         hits = pyskani_db.query(sample, *sequence)
         for hit in hits:
-            similarity_matrix.at[sample, hit.reference_name] = hit.identity
+            for reference in name_to_samples.get(hit.reference_name, []):
+                queried[index[sample], index[reference]] = hit.identity
 
     # This similarity matrix is not always symmetric. We enforce this to get a nice diagonal after clustering.
-    similarity_matrix = (similarity_matrix + similarity_matrix.T) / 2
+    both = changed[:, np.newaxis] & changed[np.newaxis, :]
+    one = changed[:, np.newaxis] ^ changed[np.newaxis, :]
+    similarity[both] = ((queried + queried.T) / 2)[both]
+    similarity[one] = (queried + queried.T)[one]
 
-    return similarity_matrix
+    return pd.DataFrame(similarity, index=samples, columns=samples), manifest
+
+
+def calculate_neighbours(
+        samples_dir: str,
+        assemblies: {str: dict},
+        manifest: {str: dict} = None,
+        previous: pd.DataFrame = None,
+        k: int = COHORT_NEIGHBOURS,
+        progress: Progress = None
+) -> (pd.DataFrame, {str: dict}):
+    """
+    Sparse alternative to calculate_similarity_matrix: the k most similar samples of each sample, as a table of
+    (sample, reference, identity). Previous neighbours of unchanged samples are reused, like the matrix.
+    """
+    logging.info(f"Calculating Phylogenetic tree from the {k} nearest neighbours...")
+    pyskani_db, name_to_samples, samples_to_sequence, manifest = sketch_cohort(
+        samples_dir, assemblies, manifest or {}, progress)
+
+    edges = []
+    if previous is not None:
+        valid = [sample for sample in assemblies if sample not in samples_to_sequence]
+        edges.append(previous[previous['sample'].isin(valid) & previous['reference'].isin(valid)])
+
+    queried = {}
+    for i, (sample, sequence) in enumerate(samples_to_sequence.items()):
+        logging.info(f"Querying pyskani db: {i}/{len(samples_to_sequence)}")
+        if progress:
+            progress('Querying pyskani db', i, len(samples_to_sequence))
+        hits = pyskani_db.query(sample, *sequence)
+        for hit in heapq.nlargest(k + 1, hits, key=lambda hit: hit.identity):  # + 1: the sample itself
+            for reference in name_to_samples.get(hit.reference_name, []):
+                if reference != sample:
+                    queried[sample, reference] = hit.identity
+
+    # Both directions get the same identity: averaged if both were queried
+    symmetric = {}
+    for (sample, reference), identity in queried.items():
+        if (reference, sample) in queried:
+            identity = (identity + queried[reference, sample]) / 2
+        symmetric[sample, reference] = symmetric[reference, sample] = identity
+    edges.append(pd.DataFrame(
+        [(sample, reference, identity) for (sample, reference), identity in symmetric.items()],
+        columns=['sample', 'reference', 'identity']
+    ))
+
+    neighbours = pd.concat(edges, ignore_index=True)
+    neighbours = neighbours.sort_values('identity', ascending=False, kind='stable').groupby('sample').head(k)
+    return neighbours.sort_values(['sample', 'identity'], ascending=[True, False]), manifest
+
+
+def neighbours_linkage(neighbours: pd.DataFrame, samples: [str]) -> np.ndarray:
+    """
+    Single linkage of the samples with distance 1 - identity, from the minimum spanning tree of the neighbour
+    graph. Samples that are not connected to each other are joined at distance 1.
+    """
+    n = len(samples)
+    index = {sample: i for i, sample in enumerate(samples)}
+    i = neighbours['sample'].map(index).to_numpy()
+    j = neighbours['reference'].map(index).to_numpy()
+    lower, upper = np.minimum(i, j), np.maximum(i, j)
+    # Each pair once; zero distances would be read as missing edges
+    pairs, first = np.unique(lower * n + upper, return_index=True)
+    distance = np.maximum(1 - neighbours['identity'].to_numpy()[first], 1e-9)
+    graph = csr_matrix((distance, (pairs // n, pairs % n)), shape=(n, n))
+    tree = minimum_spanning_tree(graph).tocoo()
+
+    order = np.argsort(tree.data, kind='stable')
+    edges = [(tree.row[e], tree.col[e], tree.data[e]) for e in order]
+    parent = np.arange(n)
+    cluster = np.arange(n)  # linkage id of the cluster rooted at each element
+    size = np.ones(n, dtype=int)
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    linkage_matrix = []
+    join_distance = max(1.0, tree.data.max(initial=0))
+    edges += [(0, x, join_distance) for x in range(1, n)]
+    for a, b, d in edges:
+        a, b = find(a), find(b)
+        if a == b:
+            continue
+        linkage_matrix.append([min(cluster[a], cluster[b]), max(cluster[a], cluster[b]), d, size[a] + size[b]])
+        parent[b] = a
+        size[a] += size[b]
+        cluster[a] = n + len(linkage_matrix) - 1
+    return np.array(linkage_matrix, dtype=float)
+
+
+def read_similarity_matrix(fname: str) -> pd.DataFrame:
+    # Read as strings: sample names like 001 must not become numbers
+    return pd.read_csv(fname, sep='\t', index_col=0, dtype=str, keep_default_na=False).astype(float)
+
+
+def read_neighbours(fname: str) -> pd.DataFrame:
+    neighbours = pd.read_csv(fname, sep='\t', dtype=str, keep_default_na=False)
+    return neighbours.astype({'identity': float})
+
+
+def read_manifest(samples_dir: str) -> {str: dict}:
+    try:
+        with open(os.path.join(samples_dir, TREE_MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def is_tree_current(samples_dir: str, assemblies: {str: dict}, manifest: {str: dict}) -> bool:
+    return (manifest.keys() == assemblies.keys()
+            and all(is_unchanged(manifest[sample], assembly) for sample, assembly in assemblies.items())
+            and os.path.isfile(os.path.join(samples_dir, TREE_PLOT))
+            and os.path.isfile(os.path.join(samples_dir, TREE_ORDER)))
+
+
+def get_phylogenetic_tree(importers: [Type[AssemblyImporter]], samples_dir: str) -> ([str], bool):
+    """
+    The samples in tree order if the tree is up to date, otherwise in alphabetical order, and whether the tree is
+    up to date. Only looks at file sizes and modification times.
+    """
+    assemblies = find_assemblies(samples_dir, importers)
+    if is_tree_current(samples_dir, assemblies, read_manifest(samples_dir)):
+        with open(os.path.join(samples_dir, TREE_ORDER)) as f:
+            return json.load(f), True
+    return sorted(assemblies), False
 
 
 def calculate_phylogenetic_tree(
         importers: [Type[AssemblyImporter]],
         samples_dir: str,
-        force_rerun: bool = False
+        force_rerun: bool = False,
+        progress: Progress = None
 ):
-    similarity_matrix_file = os.path.join(samples_dir, 'similarity_matrix.tsv')
-    similarity_matrix_plot = os.path.join(samples_dir, 'similarity_matrix.svg')
-    similarity_matrix_plot_order = os.path.join(samples_dir, 'similarity_matrix.json')
-    if (not force_rerun
-            and os.path.isfile(similarity_matrix_file)
-            and os.path.isfile(similarity_matrix_plot)
-            and os.path.isfile(similarity_matrix_plot_order)):
+    similarity_matrix_file = os.path.join(samples_dir, SIMILARITY_MATRIX)
+    neighbours_file = os.path.join(samples_dir, SIMILARITY_NEIGHBOURS)
+    similarity_matrix_plot = os.path.join(samples_dir, TREE_PLOT)
+    similarity_matrix_plot_order = os.path.join(samples_dir, TREE_ORDER)
+    manifest_file = os.path.join(samples_dir, TREE_MANIFEST)
+
+    assemblies = find_assemblies(samples_dir, importers)
+    sparse = len(assemblies) > COHORT_DENSE_MAX_SAMPLES
+    previous_file, other_file = (neighbours_file, similarity_matrix_file) if sparse else \
+        (similarity_matrix_file, neighbours_file)
+    manifest, previous = {}, None
+    if not force_rerun and os.path.isfile(previous_file):
+        manifest = read_manifest(samples_dir)
+        previous = read_neighbours(previous_file) if sparse else read_similarity_matrix(previous_file)
+
+    if is_tree_current(samples_dir, assemblies, manifest):
         logging.info(f"Skipping phylogenetic tree calculation.")
         with open(similarity_matrix_plot_order) as f:
             samples_sorted = json.load(f)
         return samples_sorted
 
-    similarity_matrix = calculate_similarity_matrix(samples_dir, importers)
-    # similarity_matrix = pd.read_csv(similarity_matrix_file, sep='\t', index_col=0)
-    similarity_matrix.to_csv(similarity_matrix_file, sep='\t')
-
-    low_score = similarity_matrix[similarity_matrix > 0].min().min()
-    similarity_matrix.replace(0, max(0, low_score - 0.02), inplace=True)
+    if sparse:
+        neighbours, manifest = calculate_neighbours(samples_dir, assemblies, manifest, previous, progress=progress)
+        neighbours.to_csv(neighbours_file, sep='\t', index=False)
+    else:
+        similarity_matrix, manifest = calculate_similarity_matrix(
+            samples_dir, assemblies, manifest, previous, progress=progress)
+        similarity_matrix.to_csv(similarity_matrix_file, sep='\t')
+    if os.path.isfile(other_file):
+        os.remove(other_file)  # would not match the manifest
+
+    if progress:
+        progress('Drawing the tree', 0, 1)
+    if sparse:
+        samples = list(assemblies)
+        leaves = plot_linkage(neighbours_linkage(neighbours, samples), similarity_matrix_plot)
+        samples_sorted = [samples[leaf] for leaf in reversed(leaves)]
+    else:
+        low_score = similarity_matrix[similarity_matrix > 0].min().min()
+        similarity_matrix.replace(0, max(0, low_score - 0.02), inplace=True)
+
+        dendrogram_params = plot_dendrogram(similarity_matrix, similarity_matrix_plot)
+        samples_sorted = list(reversed(dendrogram_params['ivl']))
 
-    dendrogram_params = plot_dendrogram(similarity_matrix, similarity_matrix_plot)
-
-    samples_sorted = list(reversed(dendrogram_params['ivl']))
     with open(similarity_matrix_plot_order, 'w') as f:
         json.dump(samples_sorted, f)
+    # Written last: the tree is only current once all other files are
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
 
     return samples_sorted
 
 
-def plot_dendrogram(similarity_matrix, fname: str):
+def read_tree_progress(samples_dir: str) -> dict:
+    try:
+        with open(os.path.join(samples_dir, TREE_PROGRESS)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'state': None}
+
+
+def write_tree_progress(samples_dir: str, state: str, step: str = None, done: int = 0, total: int = 0):
+    """state: queued, running, done or failed"""
+    path = os.path.join(samples_dir, TREE_PROGRESS)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'state': state, 'step': step, 'done': done, 'total': total, 'updated': time.time()}, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def dendrogram_figure(n_samples: int) -> (plt.Figure, plt.Axes):
     plt.rcParams['svg.fonttype'] = 'none'
 
     # calculate plot proportions
-    content_height = len(similarity_matrix.index) / 3  # height dependent on number of compounds
+    content_height = n_samples / 3  # height dependent on number of compounds
 
     # create matplotlib figure
     plt.close()
     fig = plt.figure(figsize=(2, content_height))  # dpi irrelevant if mpl.use('SVG')
     ax = fig.add_axes([0, 0, .95, 1])  # [left, bottom, width, height]
+    return fig, ax
 
-    # Compute the linkage matrix manually so it can be returned
-    linkage_matrix = sch.linkage(similarity_matrix, method='single')
-
-    dendrogram_params = sch.dendrogram(
-        linkage_matrix,
-        orientation='left',
-        labels=similarity_matrix.index,
-        no_labels=True,
-        ax=ax,
-        color_threshold=0,
-        above_threshold_color='k'  # greyscale
-    )
 
+def save_dendrogram(fig: plt.Figure, ax: plt.Axes, fname: str):
     ax.grid(False)
     plt.box(False)
     ax.tick_params(
@@ -148,4 +449,49 @@ def plot_dendrogram(similarity_matrix, fname: str):
     with open(fname, 'w') as f:
         f.write(svg_content)
 
+
+def plot_dendrogram(similarity_matrix, fname: str):
+    fig, ax = dendrogram_figure(len(similarity_matrix.index))
+
+    # Compute the linkage matrix manually so it can be returned
+    linkage_matrix = sch.linkage(similarity_matrix, method='single')
+
+    dendrogram_params = sch.dendrogram(
+        linkage_matrix,
+        orientation='left',
+        labels=similarity_matrix.index,
+        no_labels=True,
+        ax=ax,
+        color_threshold=0,
+        above_threshold_color='k'  # greyscale
+    )
+
+    save_dendrogram(fig, ax, fname)
+
     return dendrogram_params
+
+
+def plot_linkage(linkage_matrix: np.ndarray, fname: str) -> np.ndarray:
+    """
+    Draw a linkage like plot_dendrogram, in linear time and memory: sch.dendrogram recurses once per level and
+    collects its output in Python lists, which does not scale to thousands of samples. Returns the leaf order.
+    """
+    n = len(linkage_matrix) + 1
+    leaves = sch.leaves_list(linkage_matrix)
+    y = np.zeros(2 * n - 1)
+    height = np.zeros(2 * n - 1)
+    y[leaves] = 10 * np.arange(n) + 5  # leaf positions of sch.dendrogram
+    segments = np.empty((n - 1, 4, 2))
+    for i, (a, b, distance, _) in enumerate(linkage_matrix):
+        a, b = int(a), int(b)
+        segments[i] = [(height[a], y[a]), (distance, y[a]), (distance, y[b]), (height[b], y[b])]
+        y[n + i] = (y[a] + y[b]) / 2
+        height[n + i] = distance
+
+    fig, ax = dendrogram_figure(n)
+    ax.add_collection(LineCollection(segments, colors='k'))
+    ax.set_ylim(0, 10 * n)
+    ax.set_xlim(linkage_matrix[:, 2].max() * 1.05, 0)  # root on the left
+    save_dendrogram(fig, ax, fname)
+
+    return leaves
@@ -0,0 +1,38 @@
+import os
+import logging
+
+from assembly_curator.main_base import recluster_sample
+from assembly_curator.ani_dendrogram import ANI_CUTOFF, CLUSTER_THRESHOLD
+from assembly_curator.utils import load_importers
+
+
+def recluster(
+        samples_dir: str,
+        sample: str,
+        cutoff: float = ANI_CUTOFF,
+        threshold: float = CLUSTER_THRESHOLD,
+        plugin_dir: str = None
+):
+    """Cluster a processed sample again from its cached similarity matrix, e.g. with another threshold"""
+    LOGLEVEL = os.environ.get('LOGLEVEL', 'INFO').upper()
+    logging.basicConfig(level=LOGLEVEL)
+
+    if plugin_dir is None:
+        plugin_dir = os.environ.get('PLUGIN_DIR', './plugins')
+    assert os.path.isdir(plugin_dir), f"Plugin directory {plugin_dir} does not exist"
+
+    importers = load_importers(plugin_dir)
+
+    sample_dir = os.path.join(samples_dir, sample)
+    assert os.path.isdir(sample_dir), f"Sample directory {sample_dir} does not exist"
+    recluster_sample(sample, sample_dir, importers, cutoff=cutoff, threshold=threshold)
+
+
+def main():
+    from fire import Fire
+
+    Fire(recluster)
+
+
+if __name__ == '__main__':
+    main()
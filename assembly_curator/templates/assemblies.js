@@ -108,43 +108,7 @@ const toggleContigGroup = function (eventOrElement, isSelected = null) {
             if (cg.tagName === 'path') cg.parentNode.appendChild(cg)
         })
     }
-}
-
-/* Get dendrogram labels */
-function aniMatrixGetDendrogramInfo(retryCount = 10) {
-    function extractData(elementId) {
-        return JSON.parse(document.getElementById(elementId).textContent)
-    }
-
-    function extractLabels(labelElements) {
-        return Array.from(labelElements).map(label => label.textContent);
-    }
-
-    function isIdentical(textArray1, textArray2) {
-        if (textArray1.length !== textArray2.length) return false
-        for (let i = 0; i < textArray1.length; i++) {
-            if (textArray1[i] !== textArray2[i]) return false
-        }
-        return true;
-    }
-
-    const data = extractData('ani-matrix-data')
-
-    const labels1 = extractLabels(document.querySelector('#ani-clustermap-container #matplotlib\\.axis_5').querySelectorAll('text'))
-    const labels2 = extractLabels(document.querySelector('#ani-clustermap-container #matplotlib\\.axis_6').querySelectorAll('text'))
-    if (!isIdentical(labels1, labels2)) {
-        const debugInfo = {axis1Labels: labels1, axis2Labels: labels2, isIdentical: false}
-        if (retryCount > 0) {
-            console.warn(`Label mismatch detected. Retrying... (${retryCount} retries left)`, debugInfo);
-            setTimeout(() => aniMatrixGetDendrogramInfo(retryCount - 1), 500);
-            return;
-        } else {
-            console.error('Dendrogram label mismatch detected after retries.', debugInfo);
-            alert('The labels on the dendrogram are not identical!');
-        }
-    } else {
-        return [labels1, data]
-    }
+    document.dispatchEvent(new CustomEvent('contig-group-toggled', {detail: {cg, selected: !isSelected}}))
 }
 
 function formatAsPercentage(floatNumber, decimalPlaces = 2) {
@@ -180,10 +144,39 @@ function createContigGroupContent(contigGroup, header) {
             <li class="list-group-item"><strong>Length</strong>: ${humanBP(md.len)}</li>
             <li class="list-group-item"><strong>GC content</strong>: ${formatAsPercentage(md.gc_rel)}</li>
             <li class="list-group-item"><strong>Coverage</strong>: ${(coverage)}x</li>
+            ${gcProfileContent(md)}
         </ul>
     </div>`
 }
 
+function gcProfileContent(md, width = 200, height = 40) {
+    // GC content and GC skew along the contigs, from the windows computed during preprocessing
+    const profiles = Object.values(md.contigs).map(contig => contig.gc_profile).filter(profile => profile)
+    if (profiles.length === 0) return ''
+    const gc = profiles.flatMap(profile => profile.gc)
+    const skew = profiles.flatMap(profile => profile.skew)
+    const binSize = Math.ceil(gc.length / width)  // at most one point per pixel
+    const bin = values => Array.from({length: Math.ceil(values.length / binSize)}, (_, i) => {
+        const chunk = values.slice(i * binSize, (i + 1) * binSize)
+        return chunk.reduce((acc, v) => acc + v, 0) / chunk.length
+    })
+    const gcBins = bin(gc), skewBins = bin(skew)
+    const [gcMin, gcMax] = [Math.min(...gcBins), Math.max(...gcBins)]
+    const gcRange = Math.max(gcMax - gcMin, 10)
+    const x = i => ((i + 0.5) * width / gcBins.length).toFixed(1)
+    const gcPoints = gcBins.map((v, i) => `${x(i)},${(height * (1 - (v - gcMin) / gcRange)).toFixed(1)}`)
+    const skewPoints = skewBins.map((v, i) => `${x(i)},${(height / 2 * (1 - v / 100)).toFixed(1)}`)
+    return `
+            <li class="list-group-item">
+                <strong>GC</strong> ${gcMin.toFixed(0)}-${gcMax.toFixed(0)}% / <strong class="gc-skew">GC skew</strong>
+                <svg class="gc-profile" viewBox="0 0 ${width} ${height}" preserveAspectRatio="none">
+                    <line x1="0" y1="${height / 2}" x2="${width}" y2="${height / 2}"/>
+                    <polyline class="gc-skew" points="${skewPoints.join(' ')}"/>
+                    <polyline class="gc" points="${gcPoints.join(' ')}"/>
+                </svg>
+            </li>`
+}
+
 function getFasta(contigGroup) {
     const contigGroupRef = window.dataset.contigGroups[contigGroup]
     const assemblerRef = window.dataset.assemblies[contigGroupRef.assembler]
@@ -365,44 +358,213 @@ function blastFasta() {
     })
 }
 
-/* Show popover on hover */
-function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
-    const paths = document.querySelectorAll('#QuadMesh_3 path');
-    const popoverMap = new Map();
-
-    function showPopover(popover, rightClick = false) {
-        if (rightClick) {
-            popover.xx_is_persistent = !popover.xx_is_persistent
-            if (!popover.xx_is_persistent) {
-                hidePopover(popover)
-                return
-            }
+/* ANI clustermap: drawn on canvases from ani_clustermap.json, so the DOM does not grow with the matrix */
+function aniMatrixInit(container) {
+    const src = container.dataset.src
+    return fetch(src).then(response => {
+        if (!response.ok) throw new Error(`${response.status} ${response.statusText}`)
+        return response.json()
+    }).then(clustermap => {
+        clustermap.similarity = aniMatrixDecode(clustermap)
+        const matrix = aniMatrixDraw(container, clustermap)
+        aniMatrixInitPopover(container, matrix)
+    }).catch(error => {
+        console.error(`Error loading ANI clustermap ${src}:`, error);
+    })
+}
+
+// Color index of every cell: only those above vmin are stored
+function aniMatrixDecode(clustermap) {
+    const n = clustermap.labels.length
+    const bytes = base64 => Uint8Array.from(atob(base64), c => c.charCodeAt(0))
+    const cells = new Uint32Array(bytes(clustermap.similarity.cells).buffer)  // little-endian, like all browsers
+    const colors = bytes(clustermap.similarity.colors)
+    const similarity = new Uint8Array(n * n)
+    cells.forEach((cell, i) => similarity[cell] = colors[i])
+    return similarity
+}
+
+function hexToRgb(hex) {
+    return [1, 3, 5].map(i => parseInt(hex.substring(i, i + 2), 16))
+}
+
+function aniMatrixDraw(container, clustermap) {
+    const {labels, clusters, linkage, similarity, vmin, vmax} = clustermap
+    const n = labels.length
+    const cell = Math.max(2, Math.min(30, Math.floor(1500 / n)))  // size of a cell in CSS pixels
+    const size = n * cell
+    const dendrogram = Math.max(60, Math.round(size * .15))
+    const bar = Math.max(8, Math.min(cell, 20))
+    const offset = dendrogram + bar + 2  // of the matrix, on both axes
+    const labelFont = `${Math.min(12, cell * .6)}px sans-serif`
+
+    // Labels on the right and at the bottom, only if they are legible
+    let labelSpace = 0
+    if (cell >= 8) {
+        const measure = document.createElement('canvas').getContext('2d')
+        measure.font = labelFont
+        labelSpace = Math.ceil(labels.reduce((max, label) => Math.max(max, measure.measureText(label).width), 0)) + 6
+    }
+    const width = offset + size + labelSpace
+
+    const base = document.createElement('canvas')
+    const overlay = document.createElement('canvas')
+    const dpr = window.devicePixelRatio || 1
+    for (const canvas of [base, overlay]) {
+        canvas.width = Math.ceil(width * dpr)
+        canvas.height = Math.ceil(width * dpr)
+        canvas.getContext('2d').scale(dpr, dpr)
+    }
+    overlay.classList.add('ani-matrix-overlay')
+    container.replaceChildren(base, overlay)
+    const ctx = base.getContext('2d')
+
+    // Heatmap: one pixel per cell, scaled up
+    const colors = clustermap.cmap.map(hexToRgb)
+    const colorOf = value => colors[value]
+    const pixels = new ImageData(n, n)
+    similarity.forEach((value, i) => {
+        const [r, g, b] = colorOf(value)
+        pixels.data[i * 4] = r
+        pixels.data[i * 4 + 1] = g
+        pixels.data[i * 4 + 2] = b
+        pixels.data[i * 4 + 3] = 255
+    })
+    const heatmap = document.createElement('canvas')
+    heatmap.width = heatmap.height = n
+    heatmap.getContext('2d').putImageData(pixels, 0, 0)
+    ctx.imageSmoothingEnabled = false
+    ctx.drawImage(heatmap, offset, offset, size, size)
+
+    // Separate the cells if they are large enough
+    if (cell >= 6) {
+        ctx.beginPath()
+        for (let i = 1; i < n; i++) {
+            ctx.moveTo(offset + i * cell, offset)
+            ctx.lineTo(offset + i * cell, offset + size)
+            ctx.moveTo(offset, offset + i * cell)
+            ctx.lineTo(offset + size, offset + i * cell)
         }
-        if (popover.xx_is_shown) return
-        popover.xx_is_shown = true
-        popover.show()
+        ctx.strokeStyle = 'white'
+        ctx.lineWidth = cell * .15
+        ctx.stroke()
     }
 
-    function hidePopover(popover) {
-        if (popover.xx_is_persistent) return
-        if (popover.xx_is_shown) {
-            popover.xx_is_shown = false
-            popover.hide()
-        }
+    // Cluster colors
+    clusters.forEach((cluster, i) => {
+        ctx.fillStyle = clustermap.cluster_colors[cluster]
+        ctx.fillRect(offset + i * cell, dendrogram, cell, bar)
+        ctx.fillRect(dendrogram, offset + i * cell, bar, cell)
+    })
+
+    // Dendrograms: leaves are numbered by their position, merged nodes follow
+    const maxHeight = linkage.reduce((max, [, , distance]) => Math.max(max, distance), 0) || 1
+    const toDendrogram = height => dendrogram - (dendrogram - 4) * height / maxHeight
+    const position = labels.map((_, i) => offset + (i + .5) * cell)
+    const height = labels.map(() => 0)
+    ctx.beginPath()
+    linkage.forEach(([a, b, distance]) => {
+        const [xa, xb] = [position[a], position[b]]
+        const [ya, yb, y] = [toDendrogram(height[a]), toDendrogram(height[b]), toDendrogram(distance)]
+        // top
+        ctx.moveTo(xa, ya)
+        ctx.lineTo(xa, y)
+        ctx.lineTo(xb, y)
+        ctx.lineTo(xb, yb)
+        // left
+        ctx.moveTo(ya, xa)
+        ctx.lineTo(y, xa)
+        ctx.lineTo(y, xb)
+        ctx.lineTo(yb, xb)
+        position.push((xa + xb) / 2)
+        height.push(distance)
+    })
+    ctx.strokeStyle = 'black'
+    ctx.lineWidth = 1
+    ctx.stroke()
+
+    // Annotations: length ratios and topologies
+    if (cell >= 12) {
+        ctx.font = `${cell * .35}px sans-serif`
+        ctx.textAlign = 'center'
+        ctx.textBaseline = 'middle'
+        clustermap.annotations.forEach(([row, col, text]) => {
+            const [r, g, b] = colorOf(similarity[row * n + col])
+            ctx.fillStyle = (.2126 * r + .7152 * g + .0722 * b) / 255 > .408 ? 'black' : 'white'
+            ctx.fillText(text, offset + (col + .5) * cell, offset + (row + .5) * cell)
+        })
     }
 
-    function forceHidePopover(popover) {
-        if (popover.xx_is_shown) popover.hide()
-        popover.xx_is_persistent = false
-        popover.xx_is_shown = false
+    if (labelSpace) {
+        ctx.font = labelFont
+        ctx.fillStyle = 'black'
+        ctx.textAlign = 'left'
+        ctx.textBaseline = 'middle'
+        labels.forEach((label, i) => {
+            ctx.fillText(label, offset + size + 3, offset + (i + .5) * cell)
+            ctx.save()
+            ctx.translate(offset + (i + .5) * cell, offset + size + 3)
+            ctx.rotate(Math.PI / 2)
+            ctx.fillText(label, 0, 0)
+            ctx.restore()
+        })
     }
 
-    const getLabels = function (id) {
-        const index = typeof id === 'string' ? parseInt(id.split('-')[1]) : id;
-        const labelCol = dendrogramLabels[index % dendrogramLabels.length];
-        const labelRow = dendrogramLabels[Math.floor(index / dendrogramLabels.length)];
-        return [labelCol, labelRow];
+    // Color scale in the top left corner
+    const legend = ctx.createLinearGradient(0, dendrogram - 10, 0, 10)
+    clustermap.cmap.forEach((color, i) => legend.addColorStop(i / 255, color))
+    ctx.fillStyle = legend
+    ctx.fillRect(10, 10, 10, dendrogram - 20)
+    ctx.fillStyle = 'black'
+    ctx.font = '10px sans-serif'
+    ctx.textAlign = 'left'
+    ctx.textBaseline = 'top'
+    ctx.fillText(`${vmax}`, 24, 10)
+    ctx.textBaseline = 'bottom'
+    ctx.fillText(`${vmin}`, 24, dendrogram - 10)
+
+    const labelIndex = new Map(labels.map((label, i) => [label, i]))
+
+    return {
+        clustermap, n, cell, offset, width, overlay,
+        cellAt(event) {
+            // {row, col} of the cell under the mouse, or null
+            const rect = overlay.getBoundingClientRect()
+            const col = Math.floor(((event.clientX - rect.left) * width / rect.width - offset) / cell)
+            const row = Math.floor(((event.clientY - rect.top) * width / rect.height - offset) / cell)
+            return row >= 0 && row < n && col >= 0 && col < n ? {row, col} : null
+        },
+        drawOverlay(hover) {
+            // Outline the selected contig groups on the diagonal and the cell under the mouse
+            const octx = overlay.getContext('2d')
+            octx.clearRect(0, 0, width, width)
+            octx.strokeStyle = 'green'
+            octx.lineWidth = Math.max(2, cell * .2)
+            document.querySelectorAll('#row-contigs .contig-group.selected').forEach(element => {
+                const i = labelIndex.get(element.getAttribute('data-cg'))
+                if (i !== undefined) octx.strokeRect(offset + i * cell, offset + i * cell, cell, cell)
+            })
+            if (hover) {
+                octx.strokeStyle = 'black'
+                octx.lineWidth = 1
+                octx.strokeRect(offset + hover.col * cell, offset + hover.row * cell, cell, cell)
+            }
+        }
     }
+}
+
+/* Show popover on hover */
+function aniMatrixSimilarity(clustermap, i) {
+    const {similarity, vmin, vmax} = clustermap
+    if (similarity[i] === 0) return `≤ ${vmin}`
+    return (vmin + similarity[i] / 255 * (vmax - vmin)).toFixed(3)
+}
+
+function aniMatrixInitPopover(container, matrix) {
+    const {clustermap, n, overlay} = matrix
+    let hoverCell = null
+    let hovered = null  // popover of the cell under the mouse
+    const persistent = new Map()  // popovers of right-clicked cells
 
     const titleFunction = function (element) {
         const labelCol = element.getAttribute('data-label-col')
@@ -417,7 +579,7 @@ function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
     const contentFunction = function (element) {
         const labelCol = element.getAttribute('data-label-col')
         const labelRow = element.getAttribute('data-label-row')
-        const similarity = dendrogramData[labelCol][labelRow]
+        const similarity = element.getAttribute('data-similarity')
         let content = ''
         if (labelCol === labelRow) {
             content += createContigGroupContent(labelCol) + '<br>'
@@ -434,21 +596,20 @@ function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
         return content
     }
 
-    paths.forEach((path, index) => {
-        // Set a unique ID for each path to target with the popover
-        const [labelCol, labelRow] = getLabels(index)
-        path.setAttribute('id', `path-${index}`);
-        path.setAttribute('data-label-col', labelCol);
-        path.setAttribute('data-label-row', labelRow);
-
-        // Add click event listener to toggle border
-        if (labelCol === labelRow) {
-            path.classList.add('contig-group');
-            path.setAttribute('data-cg', labelCol);
-            path.addEventListener('click', toggleContigGroup);
-        }
-
-        const popoverInstance = new bootstrap.Popover(path, {
+    function createPopover({row, col}) {
+        // Popovers need an element: place an invisible one over the cell
+        const anchor = document.createElement('div')
+        const percent = value => `${value / matrix.width * 100}%`
+        anchor.classList.add('ani-matrix-anchor')
+        anchor.style.left = percent(matrix.offset + col * matrix.cell)
+        anchor.style.top = percent(matrix.offset + row * matrix.cell)
+        anchor.style.width = anchor.style.height = percent(matrix.cell)
+        anchor.setAttribute('data-label-col', clustermap.labels[col])
+        anchor.setAttribute('data-label-row', clustermap.labels[row])
+        anchor.setAttribute('data-similarity', aniMatrixSimilarity(clustermap, row * n + col))
+        container.appendChild(anchor)
+
+        const popover = new bootstrap.Popover(anchor, {
             trigger: 'manual',
             animation: false,
             html: true,
@@ -459,7 +620,7 @@ function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
             placement: 'bottom'
         })
 
-        path.addEventListener('shown.bs.popover', function () {
+        anchor.addEventListener('shown.bs.popover', function () {
             document.querySelectorAll('.dotplot-button').forEach(button => {
                 button.removeEventListener('click', loadDotplot); // Ensure no duplicate listeners
                 button.addEventListener('click', loadDotplot);
@@ -470,29 +631,62 @@ function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
             });
         });
 
-        // custom variables
-        popoverInstance.xx_is_shown = false
-        popoverInstance.xx_is_persistent = false
+        popover.show()
+        return {anchor, popover, key: `${row}-${col}`}
+    }
+
+    function removePopover({anchor, popover}) {
+        popover.dispose()
+        anchor.remove()
+    }
 
-        // add to popoverMap
-        popoverMap.set(path, popoverInstance);
+    function hideAll() {
+        persistent.forEach(removePopover)
+        persistent.clear()
+    }
 
-        // Show popover on mouseenter
-        path.addEventListener('mouseenter', function (event) {
-            showPopover(popoverInstance);
-        });
+    overlay.addEventListener('mousemove', function (event) {
+        hoverCell = matrix.cellAt(event)
+        const key = hoverCell && `${hoverCell.row}-${hoverCell.col}`
+        if (hovered && hovered.key === key) return
+        if (hovered) removePopover(hovered)
+        hovered = null
+        matrix.drawOverlay(hoverCell)
+        if (hoverCell && !persistent.has(key)) hovered = createPopover(hoverCell)
+    });
 
-        // Hide popover on mouseleave
-        path.addEventListener('mouseleave', function (event) {
-            hidePopover(popoverInstance);
-        });
+    overlay.addEventListener('mouseleave', function () {
+        if (hovered) removePopover(hovered)
+        hovered = hoverCell = null
+        matrix.drawOverlay(null)
+    });
 
-        // Show persistent popover on right-click
-        path.addEventListener('contextmenu', function (event) {
-            event.preventDefault();
-            showPopover(popoverInstance, true);
-        });
-    })
+    // Toggle the contig group on click on the diagonal
+    overlay.addEventListener('click', function (event) {
+        const cell = matrix.cellAt(event)
+        if (cell && cell.row === cell.col) toggleContigGroup(clustermap.labels[cell.col])
+    });
+
+    // Show persistent popover on right-click
+    overlay.addEventListener('contextmenu', function (event) {
+        event.preventDefault();
+        const cell = matrix.cellAt(event)
+        if (!cell) return
+        const key = `${cell.row}-${cell.col}`
+        if (persistent.has(key)) {
+            removePopover(persistent.get(key))
+            persistent.delete(key)
+        } else if (hovered && hovered.key === key) {
+            persistent.set(key, hovered)
+            hovered = null
+        } else {
+            persistent.set(key, createPopover(cell))
+        }
+    });
+
+    // The selection may change anywhere on the page
+    document.addEventListener('contig-group-toggled', () => matrix.drawOverlay(hoverCell))
+    matrix.drawOverlay(null)
 
     // Hide all persistent popovers if clicked outside
     document.addEventListener('click', function (event) {
@@ -501,7 +695,7 @@ function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
         // Ensure the click is not on a popover or the dotplot is being used
         const closestPopoverElement = event.target.closest('.popover, #dotplot-overlay')
         if (closestPopoverElement) return
-        popoverMap.forEach(forceHidePopover)
+        hideAll()
     })
 
     // Hide all persistent popovers if escape key is pressed
@@ -511,7 +705,7 @@ function aniMatrixInitPopover(dendrogramLabels, dendrogramData) {
             if (dotplotOverlay) {
                 dotplotOverlay.remove()
             } else {
-                popoverMap.forEach(forceHidePopover)
+                hideAll()
             }
         }
     })
@@ -661,6 +855,82 @@ function dotplotsInitPopover() {
 }
 
 
+function dotplotsInitTiles(svg, manifestUrl) {
+    /* Place the raster tiles of each pair below the axes of the SVG overlay, loading only the visible ones */
+    const baseUrl = manifestUrl.substring(0, manifestUrl.lastIndexOf('/') + 1)
+    return fetch(manifestUrl).then(response => response.json()).then(manifest => {
+        const layers = Object.entries(manifest.axes).map(([gid, axes]) => {
+            const patch = svg.getElementById(gid).querySelector('[id^="patch_"]')
+            const layer = document.createElementNS('http://www.w3.org/2000/svg', 'g')
+            layer.classList.add('dotplot-tiles')
+            patch.after(layer)
+            return {axes, box: patch.getBBox(), layer, loaded: new Set()}
+        })
+
+        const update = () => {
+            if (svg.getBoundingClientRect().width === 0) return  // tab not shown
+            const ctm = svg.getScreenCTM()
+            const zoom = ctm.a * window.devicePixelRatio * (window.visualViewport ? window.visualViewport.scale : 1)
+            // Visible part of the SVG in user coordinates
+            const view = {
+                left: -ctm.e / ctm.a, right: (window.innerWidth - ctm.e) / ctm.a,
+                top: -ctm.f / ctm.d, bottom: (window.innerHeight - ctm.f) / ctm.d
+            }
+            layers.forEach(layer => dotplotsLoadTiles(layer, manifest, baseUrl, zoom, view))
+        }
+        update()
+        dotplotsZoom(svg, update)
+        window.addEventListener('scroll', update, {passive: true})
+        window.addEventListener('resize', update)
+        if (window.visualViewport) window.visualViewport.addEventListener('resize', update)
+        document.querySelectorAll('#cluster-tabs .nav-link').forEach(tab => tab.addEventListener('shown.bs.tab', update))
+    }).catch(error => {
+        console.error(`Error loading dotplot tiles ${manifestUrl}:`, error);
+    })
+}
+
+function dotplotsLoadTiles({axes, box, layer, loaded}, manifest, baseUrl, zoom, view) {
+    // Lowest level that has at least one tile pixel per screen pixel
+    let level = 0
+    while (level < manifest.levels - 1 && axes.sizes[level][0] < box.width * zoom) level++
+
+    const [width, height] = axes.sizes[level]
+    const [scaleX, scaleY] = [box.width / width, box.height / height]
+    const size = manifest.tile_size
+    axes.tiles[level].forEach(name => {
+        const key = `${level}/${name}`
+        if (loaded.has(key)) return
+        const [tileX, tileY] = name.split('-').map(Number)
+        const x = box.x + tileX * size * scaleX, y = box.y + tileY * size * scaleY
+        const w = Math.min(size, width - tileX * size) * scaleX, h = Math.min(size, height - tileY * size) * scaleY
+        if (x > view.right || x + w < view.left || y > view.bottom || y + h < view.top) return
+
+        const image = document.createElementNS('http://www.w3.org/2000/svg', 'image')
+        image.setAttribute('href', `${baseUrl}${axes.row}-${axes.col}/${key}.${manifest.format}?v=${manifest.version}`)
+        Object.entries({x, y, width: w, height: h}).forEach(([attr, value]) => image.setAttribute(attr, value))
+        image.setAttribute('preserveAspectRatio', 'none')
+        image.dataset.level = level
+        // Higher levels are drawn on top of lower ones, which stay as placeholder
+        const next = Array.from(layer.children).find(other => Number(other.dataset.level) > level)
+        layer.insertBefore(image, next || null)
+        loaded.add(key)
+    })
+}
+
+function dotplotsZoom(svg, onZoom) {
+    /* Ctrl + mouse wheel zooms into a tiled dotplot, the tab pane scrolls */
+    let scale = 1
+    svg.addEventListener('wheel', event => {
+        if (!event.ctrlKey) return
+        event.preventDefault()
+        scale = Math.min(Math.max(scale * (event.deltaY < 0 ? 1.25 : 0.8), 1), 16)
+        svg.style.width = `${scale * 100}%`
+        svg.style.maxWidth = 'none'
+        onZoom()
+    }, {passive: false})
+}
+
+
 // Trigger toggleContigGroup on click on contigs in the table
 function toggleContigGroupTable() {
     document.querySelectorAll('#row-contigs [data-cg]').forEach((contig) => {
@@ -669,13 +939,6 @@ function toggleContigGroupTable() {
 }
 
 
-function aniMatrixDeactivateAnnotations() {
-    document.getElementById('ani-clustermap-container')
-        .querySelectorAll('#axes_5 > [id^="text_"]')
-        .forEach((textElement) => {
-            textElement.style.pointerEvents = 'none';
-        });
-}
 
 // click on #btn-curate will send the selected contigs to the server (/curate)
 document.getElementById('btn-export').addEventListener('click', function () {
@@ -786,8 +1049,8 @@ function activateAniZoom() {
 
     // Function to adjust the SVG width based on scale
     function adjustSVGWidth() {
-        const svg = container.querySelector('svg') || container.querySelector('img')
-        svg.style.width = `${scale * 100}%`;
+        const matrix = container.querySelector('#ani-matrix')
+        matrix.style.width = `${scale * 100}%`;
     }
 
     // Zoom In Function
@@ -1023,17 +1286,20 @@ document.addEventListener('DOMContentLoaded', function () {
     loadNoteMd()
 
     metadata.then(() => {
-        fetchAndReplace(document.getElementById('ani-matrix-svg')).then(() => {
-            const [dendrogramLabels, dendrogramData] = aniMatrixGetDendrogramInfo();
-            aniMatrixDeactivateAnnotations()
-            aniMatrixInitPopover(dendrogramLabels, dendrogramData);
-        })
+        aniMatrixInit(document.getElementById('ani-matrix'))
 
         const replaceGfaviz = Promise.all(Array.from(document.querySelectorAll('.gfaviz-svg')).map(fetchAndReplace)).then(() => {
             gfavizInitPopover();
         });
 
-        const replaceDotplots = Promise.all(Array.from(document.querySelectorAll('.dotplot-svg')).map(fetchAndReplace)).then(() => {
+        const replaceDotplots = Promise.all(Array.from(document.querySelectorAll('.dotplot-svg')).map(img => {
+            const container = img.parentNode
+            const tiles = img.dataset.tiles
+            return Promise.resolve(fetchAndReplace(img)).then(() => {
+                const svg = container.querySelector('svg')
+                if (tiles && svg) return dotplotsInitTiles(svg, tiles)
+            })
+        })).then(() => {
             dotplotsInitPopover()
         })
 
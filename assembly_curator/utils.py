@@ -1,6 +1,7 @@
 # Plugin system inspired by https://gist.github.com/dorneanu/cce1cd6711969d581873a88e0257e312
 import os
 import sys
+import gzip
 import logging
 import subprocess
 import multiprocessing
@@ -49,6 +50,8 @@ def load_module(path):
 _importers = None
 _get_custom_html = None
 
+CACHE_DIR = '.assembly-curator-cache'
+
 
 def load_importers(plugins_dir: str) -> List[Type['AssemblyImporter']]:
     global _importers
@@ -94,6 +97,29 @@ def load_get_custom_html(plugins_dir: str) -> Callable:
     return _get_custom_html
 
 
+def get_cache_dir(samples_dir: str, name: str) -> str:
+    """Caches shared by all samples are stored in a hidden folder in the samples directory"""
+    return os.path.join(samples_dir, CACHE_DIR, name)
+
+
+def compressed_path(path: str) -> str:
+    """The path, or that of its gzip/bgzip-compressed version if only that exists"""
+    if not os.path.exists(path) and os.path.exists(f'{path}.gz'):
+        return f'{path}.gz'
+    return path
+
+
+def is_gzipped(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def open_text(path: str):
+    """Open a text file for reading, which may be compressed with gzip or bgzip"""
+    path = compressed_path(path)
+    return gzip.open(path, 'rt') if is_gzipped(path) else open(path)
+
+
 def human_bp(bp: int, decimals: int = 1, zero_val='0bp') -> str:
     if bp == 0:
         return zero_val
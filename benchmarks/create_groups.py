@@ -0,0 +1,70 @@
+"""
+Benchmark AssemblyImporter.create_groups on synthetic assembly graphs.
+
+Graphs have twice as many edges as segments, spread over many components, and are symmetric like the connections
+of load_gfa. On the smaller graphs, the groups are compared to those of the previous implementation, which scanned
+the list of groups for every edge.
+
+Usage: python -m benchmarks.create_groups [--max_edges=1000000] [--reference_max_edges=10000] [--seed=0]
+"""
+import time
+import random
+from types import SimpleNamespace
+
+from assembly_curator.AssemblyImporter import AssemblyImporter
+
+
+def reference_create_groups(connections) -> [[str]]:
+    groups = [[segment] for segment in connections.keys()]
+    for segment, connected_segments in connections.items():
+        for connected_segment in connected_segments:
+            group1 = next(group for group in groups if segment in group)
+            group2 = next(group for group in groups if connected_segment in group)
+            if group1 is group2:
+                continue
+            group1.extend(group2)
+            groups.remove(group2)
+    return groups
+
+
+def synthetic_graph(n_edges: int, seed: int = 0) -> {str: set}:
+    """Random links within components of 1 to 200 segments, plus self-links (circular contigs)"""
+    rng = random.Random(seed)
+    n_segments = max(n_edges // 2, 1)
+    connections = {f'edge_{i}': set() for i in range(n_segments)}
+    segments = list(connections)
+    components, start = [], 0
+    while start < n_segments:
+        end = min(start + rng.randint(1, 200), n_segments)
+        components.append((start, end))
+        start = end
+    for _ in range(n_edges):
+        start, end = rng.choice(components)
+        segment1, segment2 = segments[rng.randrange(start, end)], segments[rng.randrange(start, end)]
+        connections[segment1].add(segment2)
+        connections[segment2].add(segment1)
+    return connections
+
+
+def main(max_edges: int = 1_000_000, reference_max_edges: int = 10_000, seed: int = 0):
+    importer = SimpleNamespace(name='benchmark')
+    n_edges = 1000
+    while n_edges <= max_edges:
+        connections = synthetic_graph(n_edges, seed)
+        start = time.perf_counter()
+        groups = AssemblyImporter.create_groups(importer, connections)
+        elapsed = time.perf_counter() - start
+        line = f'{n_edges:>9,} edges {len(connections):>9,} segments {len(groups):>7,} groups  union-find {elapsed:8.3f}s'
+        if n_edges <= reference_max_edges:
+            start = time.perf_counter()
+            reference = reference_create_groups(connections)
+            line += f'  list scan {time.perf_counter() - start:8.3f}s'
+            assert groups == reference, f'Groups differ from the reference for {n_edges} edges'
+        print(line)
+        n_edges *= 10
+
+
+if __name__ == '__main__':
+    from fire import Fire
+
+    Fire(main)
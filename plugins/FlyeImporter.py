@@ -1,6 +1,6 @@
 import logging
 import pandas as pd
-from assembly_curator.utils import AssemblyFailedException
+from assembly_curator.utils import AssemblyFailedException, compressed_path
 from assembly_curator.AssemblyImporter import AssemblyImporter
 from assembly_curator.Assembly import Assembly
 from assembly_curator.Contig import Contig
@@ -50,7 +50,7 @@ class FlyeImporter(AssemblyImporter):
             1) add coverage information to contigs
             2) sanity check: make sure gfa was parsed correctly
         """
-        df = pd.read_csv(assembly_info, sep='\t', index_col=0)
+        df = pd.read_csv(compressed_path(assembly_info), sep='\t', index_col=0)
 
         assert set(df.index) == set(contigs), \
             f'Mismatch in {assembly_info} and {contigs=}!\n{set(df.index)=}\n{set(contigs)=}'